@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+
+Benchmark resolving labels such as '3.b.12' in a large tree: the old depth-first search
+against the TaskTree label index
+
+Usage:  python3 benchmarks/bench_label_lookup.py [lookups]
+
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+from tasktree import TaskTree
+from treegen import writeTree
+
+
+def lookupDepthFirst(node, label):
+    """
+    The search TreeNode.lookupRowid used before the label index existed
+    """
+
+    if node.label[:-1] == label or node.label == label:
+        return node.rowid
+
+    for childNode in node.children:
+        rowid = lookupDepthFirst(childNode, label)
+        if rowid != -1:
+            return rowid
+
+    return -1
+
+def timeLookups(lookup, labels):
+
+    start = time.perf_counter()
+    for label in labels:
+        lookup(label)
+
+    return (time.perf_counter() - start) / len(labels)
+
+def main():
+
+    lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    with tempfile.TemporaryDirectory() as directory:
+        with TodoDatabase(os.path.join(directory, "bench.sqlite")) as database:
+            (firstLevel, size) = writeTree(database, [40, 50, 50])
+            taskTree = TaskTree(database)
+
+            rng = random.Random(0)
+            labels = rng.sample(sorted(taskTree.labelTable), lookups)
+            labels.append("3.b.12")
+
+            depthFirst = timeLookups(lambda label: lookupDepthFirst(taskTree.root, label), labels)
+            indexed = timeLookups(taskTree.lookupRowid, labels * 1000)
+
+    print("resolved " + str(len(labels)) + " labels in a tree of " + str(size) + " tasks")
+    print("    depth-first search: %10.2f us/lookup" % (1e6 * depthFirst))
+    print("    label index:        %10.2f us/lookup" % (1e6 * indexed))
+    print("    speedup:            %10.0fx" % (depthFirst / indexed))
+
+if  __name__ =='__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+
+Memory benchmark: bytes per task held by the in-memory task tree, comparing the compact
+__slots__ TreeNode/TodoTask with the dict-based node layout they replaced
+
+Usage:  python3 benchmarks/bench_memory.py [fanout] [levels]    (default 100 3, about 1M tasks)
+
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from todotask import TodoTask
+from tasktree import TreeNode
+
+
+class LegacyTodoTask:
+    """
+    TodoTask as it was before __slots__ and status interning
+    """
+
+    def __init__(self, description, position=None, completionStatus='todo'):
+
+        self.description = description
+        self.position = position
+        self.completionStatus = completionStatus
+
+class LegacyTreeNode:
+    """
+    TreeNode as it was before __slots__: a __dict__ and a list of children on every node
+    """
+
+    def __init__(self, rowid, parentID, task, depth=0):
+
+        self.label = ""
+        self.rowid = rowid
+        self.parentID = parentID
+        self.depth = depth
+
+        self.task = task
+        self.children = []
+
+    def addChild(self, childNode):
+
+        self.children.append(childNode)
+        childNode.depth = self.depth + 1
+        if self.depth > 0:
+            childNode.label = self.label + str(childNode.task.position) + "."
+
+def buildTree(taskClass, nodeClass, fanout, levels):
+    """
+    Build a tree in memory the way initializeTaskTree does: one task object per row, with
+    every string freshly created as if it had just been decoded from SQLite
+    """
+
+    root = nodeClass(1, None, taskClass("[root]", 1, "na"))
+    mode = nodeClass(2, 1, taskClass("[default]", 1, "na"), 1)
+    root.addChild(mode)
+
+    nextRowid = 3
+    frontier = [mode]
+    for level in range(levels):
+        newFrontier = list()
+        for parent in frontier:
+            for position in range(1, fanout + 1):
+                status = "".join(["to", "do"])
+                task = taskClass("task " + str(nextRowid), position, status)
+                node = nodeClass(nextRowid, parent.rowid, task)
+                parent.addChild(node)
+                newFrontier.append(node)
+                nextRowid += 1
+        frontier = newFrontier
+
+    return (root, nextRowid - 3)
+
+def measure(taskClass, nodeClass, fanout, levels):
+    """
+    Return (bytes per task, number of tasks) allocated while building a tree
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    (root, count) = buildTree(taskClass, nodeClass, fanout, levels)
+    (allocated, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del root
+    gc.collect()
+
+    return (allocated / count, count)
+
+def main():
+
+    fanout = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    levels = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    (legacy, count) = measure(LegacyTodoTask, LegacyTreeNode, fanout, levels)
+    (compact, count) = measure(TodoTask, TreeNode, fanout, levels)
+
+    print("built a tree of " + str(count) + " tasks")
+    print("    dict-based nodes:   %8.1f bytes/task" % legacy)
+    print("    __slots__ nodes:    %8.1f bytes/task" % compact)
+    print("    saving:             %8.1f %%" % (100 * (legacy - compact) / legacy))
+
+if  __name__ =='__main__':
+    main()
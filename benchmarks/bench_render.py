@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+
+Benchmark rendering a large list: a full render against the re-render after marking one task done
+
+Usage:  python3 benchmarks/bench_render.py [fanout ...]    (default 20 1000, about 20k lines)
+
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+from tasktree import TaskTree
+from tasktree import TreeNode
+from treegen import writeTree
+
+
+renderedLines = 0
+renderLine = TreeNode.renderLine
+
+def countingRenderLine(node, level):
+    """
+    TreeNode.renderLine wrapper counting how many lines are formatted
+    """
+
+    global renderedLines
+    renderedLines += 1
+    return renderLine(node, level)
+
+def timeRender(taskTree):
+
+    global renderedLines
+    renderedLines = 0
+
+    start = time.perf_counter()
+    output = str(taskTree)
+    elapsed = time.perf_counter() - start
+
+    return (elapsed, renderedLines, output.count("\n"))
+
+def main():
+
+    fanouts = [int(arg) for arg in sys.argv[1:]] or [20, 1000]
+    TreeNode.renderLine = countingRenderLine
+
+    with tempfile.TemporaryDirectory() as directory:
+        with TodoDatabase(os.path.join(directory, "bench.sqlite")) as database:
+            writeTree(database, fanouts)
+            taskTree = TaskTree(database)
+
+            (cold, coldLines, size) = timeRender(taskTree)
+            (cached, cachedLines, size) = timeRender(taskTree)
+
+            taskTree.setDone("2.c")
+            (afterDone, afterDoneLines, size) = timeRender(taskTree)
+
+    print("rendered a list of " + str(size) + " lines")
+    print("    first render:       %8.2f ms  (%d lines formatted)" % (1e3 * cold, coldLines))
+    print("    unchanged render:   %8.2f ms  (%d lines formatted)" % (1e3 * cached, cachedLines))
+    print("    after 'done 2.c':   %8.2f ms  (%d lines formatted)" % (1e3 * afterDone, afterDoneLines))
+
+if  __name__ =='__main__':
+    main()
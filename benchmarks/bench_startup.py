@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+
+Benchmark cold start to the first prompt: wall-clock time of 'python3 mfnd --profile-startup'
+(which stops where the prompt would be shown) and its own breakdown into imports, opening the
+database, loading the tree and starting the shell, for lists of growing size. Each list is
+loaded both from SQLite and from the snapshot file of its tree
+
+Each run uses a copy of mfnd in a temporary directory, so the real to-do list is left alone.
+
+Usage:  python3 benchmarks/bench_startup.py [tasks ...]    (default 0 10000 100000)
+
+"""
+
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from treegen import writeTree
+from database import TodoDatabase
+
+
+RUNS = 10
+
+def runMfnd(directory, *args):
+    """
+    Run mfnd from 'directory' with 'args'. Return what it printed
+    """
+
+    return subprocess.run([sys.executable, os.path.join(directory, "mfnd")] + list(args),
+        stdout=subprocess.PIPE, stdin=subprocess.DEVNULL, check=True, universal_newlines=True).stdout
+
+def profileStartup(directory, *args):
+    """
+    Start mfnd once. Return the wall-clock time and the step times it reported, in ms
+    """
+
+    start = time.perf_counter()
+    output = runMfnd(directory, "--profile-startup", *args)
+    wall = 1e3 * (time.perf_counter() - start)
+
+    steps = dict((name, float(ms)) for (name, ms) in re.findall(r'^ +([a-z ]+?) +([0-9.]+)$', output, re.M))
+
+    return (wall, steps)
+
+def main():
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [0, 10000, 100000]
+    source = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd")
+
+    names = ["imports", "open database", "load task tree", "start shell", "total"]
+    print("%8s  %-8s  %10s  " % ("tasks", "from", "wall ms") + "  ".join("%14s" % name for name in names))
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            shutil.copytree(source, os.path.join(directory, "mfnd"),
+                ignore=shutil.ignore_patterns("__pycache__"))
+            os.mkdir(os.path.join(directory, "data"))
+
+            with TodoDatabase(os.path.join(directory, "data", "todo_list.sqlite")) as database:
+                if size > 0:
+                    writeTree(database, [size])
+
+            # The first run compiles the bytecode, warms the page cache and writes the snapshot
+            runMfnd(directory, "-f", os.devnull)
+
+            for (loadedFrom, args) in (("sqlite", ["--no-snapshot"]), ("snapshot", [])):
+                runs = [profileStartup(directory, *args) for run in range(RUNS)]
+
+                wall = statistics.median(run[0] for run in runs)
+                steps = [statistics.median(run[1][name] for run in runs) for name in names]
+                print("%8d  %-8s  %10.2f  " % (size, loadedFrom, wall) + "  ".join("%14.2f" % ms for ms in steps))
+
+if  __name__ =='__main__':
+    main()
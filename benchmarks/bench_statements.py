@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+
+Micro-benchmark comparing concatenated SQL with the parameterized statements in TodoDatabase
+
+Usage:  python3 benchmarks/bench_statements.py [count]
+
+"""
+
+import os
+import sys
+import time
+import sqlite3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+
+
+def openScratch():
+    """
+    Open an in-memory database holding only the TodoTask table, so the timing isolates
+    statement parsing/planning from trigger work
+    """
+
+    conn = sqlite3.connect(":memory:")
+    conn.isolation_level = None
+    conn.execute(TodoDatabase.CREATE_TABLE_TODOTASK)
+
+    # INSERT_TASK also writes the depth column added by a later migration
+    conn.execute("ALTER TABLE TodoTask ADD COLUMN depth INT;")
+    conn.execute("BEGIN")
+    return conn
+
+def insertConcatenated(conn, count):
+    """
+    Insert 'count' tasks with a distinct SQL string per call (the old strSQLite approach)
+    """
+
+    c = conn.cursor()
+    for i in range(count):
+        description = "task " + str(i) + " isn't quoted"
+        sql = '''
+        INSERT INTO TodoTask (parentID, description, position, completionStatus)
+        VALUES (2, \'''' + description.replace("'", "''") + '''\', ''' + str(i + 1) + ''', 'todo');
+        '''
+        c.execute(sql)
+
+def insertParameterized(conn, count):
+    """
+    Insert 'count' tasks through the single cached INSERT_TASK statement
+    """
+
+    c = conn.cursor()
+    for i in range(count):
+        params = {
+            'parentID': 2,
+            'description': "task " + str(i) + " isn't quoted",
+            'position': i + 1,
+            'completionStatus': 'todo'
+        }
+        c.execute(TodoDatabase.INSERT_TASK, params)
+
+def timeRun(func, count):
+
+    conn = openScratch()
+    start = time.perf_counter()
+    func(conn, count)
+    elapsed = time.perf_counter() - start
+    conn.execute("COMMIT")
+    conn.close()
+
+    return elapsed
+
+def main():
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    concatenated = timeRun(insertConcatenated, count)
+    parameterized = timeRun(insertParameterized, count)
+
+    print("inserted " + str(count) + " tasks")
+    print("    concatenated SQL:   %8.3f s  (%6.2f us/task)" % (concatenated, 1e6 * concatenated / count))
+    print("    parameterized SQL:  %8.3f s  (%6.2f us/task)" % (parameterized, 1e6 * parameterized / count))
+    print("    speedup:            %8.2fx" % (concatenated / parameterized))
+
+if  __name__ =='__main__':
+    main()
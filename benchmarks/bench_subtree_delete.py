@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+
+Benchmark deleting a large branch: the old recursive TodoTask_delete trigger against
+the set-based TodoDatabase.deleteTask
+
+Usage:  python3 benchmarks/bench_subtree_delete.py [fanout] [levels]
+
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+from treegen import writeTree
+
+
+# The trigger TodoDatabase installed before schema migration 2
+LEGACY_TRIGGER_TODOTASK_DELETE = '''
+CREATE TRIGGER IF NOT EXISTS TodoTask_delete AFTER DELETE ON TodoTask
+BEGIN
+    DELETE FROM ClosureTable
+    WHERE childID IN (
+        SELECT DISTINCT p.childID
+        FROM ClosureTable p, ClosureTable c
+        WHERE p.parentID = old.rowid AND c.childID = p.childID
+    );
+
+    DELETE FROM TodoTask 
+    WHERE parentID = old.rowid;
+
+    UPDATE TodoTask
+        SET position = position - 1
+        WHERE position > old.position AND parentID = old.parentID;
+END;
+'''
+
+def deleteLegacy(database, rowid):
+
+    conn = database.connection()
+    conn.execute("PRAGMA recursive_triggers = ON;")
+    with database.transaction() as c:
+        c.execute(LEGACY_TRIGGER_TODOTASK_DELETE)
+    with database.transaction() as c:
+        start = time.perf_counter()
+        c.execute("DELETE FROM TodoTask WHERE rowid = ?;", (rowid,))
+        elapsed = time.perf_counter() - start
+
+    return elapsed
+
+def deleteSetBased(database, rowid):
+
+    start = time.perf_counter()
+    database.deleteTask(rowid)
+
+    return time.perf_counter() - start
+
+def timeRun(func, fanout, levels):
+
+    with tempfile.TemporaryDirectory() as directory:
+        with TodoDatabase(os.path.join(directory, "bench.sqlite")) as database:
+            ([rowid], size) = writeTree(database, [1] + [fanout] * levels)
+            elapsed = func(database, rowid)
+            remaining = database.connection().execute("SELECT COUNT(*) FROM TodoTask;").fetchone()[0]
+
+    return (elapsed, size, remaining)
+
+def main():
+
+    fanout = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    levels = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    (legacy, size, legacyRemaining) = timeRun(deleteLegacy, fanout, levels)
+    (setBased, size, setBasedRemaining) = timeRun(deleteSetBased, fanout, levels)
+
+    print("deleted a branch of " + str(size) + " tasks")
+    print("    recursive trigger:  %8.3f s  (%d rows left)" % (legacy, legacyRemaining))
+    print("    set-based delete:   %8.3f s  (%d rows left)" % (setBased, setBasedRemaining))
+    print("    speedup:            %8.2fx" % (legacy / setBased))
+
+if  __name__ =='__main__':
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+
+Benchmark suite: times every operation the shell exposes, plus startup and a full render, on
+synthetic lists of several shapes and sizes (see treegen.py), and compares two runs
+
+Usage:  python3 benchmarks/bench_suite.py run [--shapes flat,deep,bushy] [--sizes 1000,10000]
+            [--repeat N] [--seed N] [--output FILE]
+        python3 benchmarks/bench_suite.py compare BASE NEW [--threshold PERCENT] [--metric p50]
+            [--min-ms MS]
+
+'run' prints a table of the timings and with --output writes them, with percentiles, as JSON.
+'compare' reads two such files and exits with status 1 if any operation got slower by more
+than the threshold (default 10%) and by more than --min-ms
+
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from treegen import SHAPES
+from treegen import writeShape
+from database import TodoDatabase
+from tasktree import TaskTree
+from todoshell import TodoShell
+
+
+# Shell commands timed on every list, in order. Each of them is run 'repeat' times on randomly
+# chosen tasks, then as many commands are undone and redone
+COMMANDS = ('todo', 'todosub', 'done', 'move up', 'move down', 'move top', 'move bottom', 'move under', 'remove')
+
+OPERATIONS = ('startup', 'startup (snapshot)', 'render') + COMMANDS + ('undo', 'redo')
+
+
+
+def percentile(values, percent):
+    """
+    Return the nearest-rank percentile of a sorted list of values
+    """
+
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+def summarize(timings):
+    """
+    Return the count, mean and percentiles of a list of timings in ms
+    """
+
+    values = sorted(timings)
+
+    return {
+        'runs': len(values),
+        'min': values[0],
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': values[-1],
+        'mean': sum(values) / len(values)
+    }
+
+def timeStartup(databasePath, snapshotPath=None):
+    """
+    Open the database, load the tree and start a shell, as 'python3 mfnd' does. Return the time taken in ms
+    """
+
+    start = time.perf_counter()
+    database = TodoDatabase(databasePath, snapshotPath=snapshotPath)
+    TodoShell(TaskTree(database))
+    elapsed = 1e3 * (time.perf_counter() - start)
+
+    database.close()
+    return elapsed
+
+def pickLabel(taskTree, rowids, rng, exclude=None):
+    """
+    Return the label (without the trailing '.') of a random task among 'rowids' still in the
+    tree, other than 'exclude' and its sub-tasks
+    """
+
+    while True:
+        node = taskTree.nodeTable.get(rng.choice(rowids))
+        if node == None or not node.label:
+            continue
+
+        label = node.label[:-1]
+        if exclude == None or (label != exclude and not label.startswith(exclude + ".")):
+            return label
+
+def commandLine(command, taskTree, rowids, rng):
+    """
+    Return a command line running 'command' on randomly chosen tasks
+    """
+
+    if command == 'todo':
+        return "todo benchmark task"
+    if command == 'todosub':
+        return "todosub " + pickLabel(taskTree, rowids, rng) + " benchmark sub-task"
+    if command == 'move under':
+        label = pickLabel(taskTree, rowids, rng)
+        return "move " + label + " under " + pickLabel(taskTree, rowids, rng, exclude=label)
+    if command.startswith('move '):
+        return "move " + pickLabel(taskTree, rowids, rng) + " " + command.split()[1]
+
+    return command + " " + pickLabel(taskTree, rowids, rng)
+
+def runCommand(shell, line, timings):
+    """
+    Run a command line in the shell, adding the time it took to 'timings'. Raise RuntimeError if
+    the shell rejected it
+    """
+
+    warnings = shell.warnings
+
+    start = time.perf_counter()
+    shell.onecmd(line)
+    timings.append(1e3 * (time.perf_counter() - start))
+
+    if shell.warnings != warnings:
+        raise RuntimeError("'" + line + "' failed")
+
+def benchmarkList(shape, size, repeat, rng):
+    """
+    Time every operation on a fresh list of about 'size' tasks in 'shape'. Return the number of
+    tasks and a dict of operation -> list of timings in ms
+    """
+
+    timings = dict((operation, list()) for operation in OPERATIONS)
+    loads = max(3, repeat // 10)
+
+    with tempfile.TemporaryDirectory() as directory:
+        databasePath = os.path.join(directory, "todo_list.sqlite")
+        snapshotPath = os.path.join(directory, "todo_list.snapshot")
+
+        with TodoDatabase(databasePath, snapshotPath=snapshotPath) as database:
+            tasks = writeShape(database, shape, size)
+            database.saveSnapshot(TaskTree(database))
+
+        for run in range(loads):
+            timings['startup'].append(timeStartup(databasePath))
+            timings['startup (snapshot)'].append(timeStartup(databasePath, snapshotPath))
+
+        with TodoDatabase(databasePath) as database, open(os.devnull, 'w') as devnull:
+            taskTree = TaskTree(database)
+            shell = TodoShell(taskTree)
+
+            # As in a script, the list is not printed after each command
+            shell.scriptLine = 0
+
+            for run in range(loads):
+                for node in taskTree.nodeTable.values():
+                    node.rendered = None
+                start = time.perf_counter()
+                str(taskTree)
+                timings['render'].append(1e3 * (time.perf_counter() - start))
+
+            rowids = [rowid for rowid in taskTree.nodeTable if rowid > 2]
+
+            with contextlib.redirect_stdout(devnull):
+                for command in COMMANDS:
+                    for run in range(repeat):
+                        runCommand(shell, commandLine(command, taskTree, rowids, rng), timings[command])
+
+                for command in ('undo', 'redo'):
+                    for run in range(repeat):
+                        runCommand(shell, command, timings[command])
+
+    return (tasks, timings)
+
+def gitCommit():
+    """
+    Return the commit the benchmarked tree is at, or None outside of a git checkout
+    """
+
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.realpath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True, universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+
+    shapes = args.shapes.split(",")
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    results = list()
+    print("%-6s %8s  %-18s %5s %9s %9s %9s %9s" % ("shape", "tasks", "operation", "runs", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+
+    for shape in shapes:
+        for size in sizes:
+            # Seeded per list, so a run of a subset of the lists picks the same tasks for them
+            rng = random.Random(str(args.seed) + "/" + shape + "/" + str(size))
+            (tasks, timings) = benchmarkList(shape, size, args.repeat, rng)
+
+            for operation in OPERATIONS:
+                result = {'shape': shape, 'size': size, 'tasks': tasks, 'operation': operation}
+                result.update(summarize(timings[operation]))
+                results.append(result)
+
+                print("%-6s %8d  %-18s %5d %9.3f %9.3f %9.3f %9.3f" % (shape, tasks, operation, result['runs'],
+                    result['p50'], result['p90'], result['p99'], result['max']))
+            sys.stdout.flush()
+
+    if args.output != None:
+        document = {
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            'commit': gitCommit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'results': results
+        }
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=1)
+            f.write("\n")
+
+def compare(args):
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    baseResults = dict(((result['shape'], result['size'], result['operation']), result) for result in base['results'])
+
+    print("Comparing %s (%s) with %s (%s), %s, regressions beyond %g%%" % (args.new, new.get('commit'),
+        args.base, base.get('commit'), args.metric, args.threshold))
+    print()
+    print("%-6s %8s  %-18s %10s %10s %8s" % ("shape", "size", "operation", "base ms", "new ms", "change"))
+
+    regressions = 0
+    unmatched = 0
+    for result in new['results']:
+        key = (result['shape'], result['size'], result['operation'])
+        if key not in baseResults:
+            unmatched += 1
+            continue
+
+        before = baseResults[key][args.metric]
+        after = result[args.metric]
+        change = 100 * (after - before) / before if before > 0 else 0
+
+        flag = ""
+        if change > args.threshold and after - before > args.min_ms:
+            flag = "  REGRESSION"
+            regressions += 1
+
+        print("%-6s %8d  %-18s %10.3f %10.3f %+7.1f%%%s" % (key + (before, after, change, flag)))
+
+    print()
+    if unmatched:
+        print(str(unmatched) + " result(s) of the new run are not in the earlier one")
+    print(str(regressions) + " regression(s)")
+
+    sys.exit(1 if regressions else 0)
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the operations of the mfnd shell")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    runParser = commands.add_parser('run', help="time every operation on synthetic lists")
+    runParser.add_argument("--shapes", default=",".join(SHAPES), help="comma-separated tree shapes (default all)")
+    runParser.add_argument("--sizes", default="1000,10000", help="comma-separated numbers of tasks (default 1000,10000)")
+    runParser.add_argument("--repeat", type=int, default=50, help="runs of each command per list (default 50)")
+    runParser.add_argument("--seed", type=int, default=1, help="seed for the tasks commands are run on")
+    runParser.add_argument("--output", metavar="FILE", help="write the results to FILE as JSON")
+    runParser.set_defaults(function=run)
+
+    compareParser = commands.add_parser('compare', help="compare the results of two runs")
+    compareParser.add_argument("base", help="results of the earlier run")
+    compareParser.add_argument("new", help="results of the later run")
+    compareParser.add_argument("--threshold", type=float, default=10, help="slowdown in %% counted as a regression (default 10)")
+    compareParser.add_argument("--metric", default="p50", choices=("min", "p50", "p90", "p99", "max", "mean"),
+        help="statistic compared (default p50)")
+    compareParser.add_argument("--min-ms", type=float, default=0.05,
+        help="smaller slowdowns are noise, however large relative to the base (default 0.05)")
+    compareParser.set_defaults(function=compare)
+
+    args = parser.parse_args()
+    args.function(args)
+
+if  __name__ =='__main__':
+    main()
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""
+
+Check that TodoDatabase's hot statements are answered from indexes rather than table scans. The
+checks are the tests in tests/test_query_plans.py, which the test suite also runs
+
+Usage:  python3 benchmarks/check_query_plans.py    (exits non-zero if a scan creeps back in)
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from tests import test_query_plans
+
+
+if  __name__ =='__main__':
+    unittest.main(module=test_query_plans, verbosity=2)
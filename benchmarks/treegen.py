@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+
+Synthetic task tree generator shared by the benchmarks
+
+Usage:  python3 benchmarks/treegen.py <database> <shape> <tasks>    (shape: flat, deep or bushy)
+
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+
+
+# Length of the chains of sub-tasks in the 'deep' shape
+CHAIN_LENGTH = 16
+
+def shapeFanouts(shape, size):
+    """
+    Return the fanouts per level (see writeTree) of a tree of about 'size' tasks in one of the
+    SHAPES: 'flat' is a single wide list, 'deep' a list of chains CHAIN_LENGTH sub-tasks deep,
+    and 'bushy' a project tree of three levels with the same fanout at each
+    """
+
+    if shape == 'flat':
+        return [size]
+    if shape == 'deep':
+        return [max(1, size // CHAIN_LENGTH)] + [1] * (CHAIN_LENGTH - 1)
+    if shape == 'bushy':
+        fanout = 1
+        while (fanout + 1) + (fanout + 1) ** 2 + (fanout + 1) ** 3 <= size:
+            fanout += 1
+        return [fanout] * 3
+
+    raise ValueError("unknown tree shape '" + shape + "' (expected one of " + ", ".join(SHAPES) + ")")
+
+SHAPES = ('flat', 'deep', 'bushy')
+
+def writeShape(database, shape, size):
+    """
+    Write a tree of about 'size' tasks in one of the SHAPES under the [default] task. Return the
+    number of tasks written
+    """
+
+    return writeTree(database, shapeFanouts(shape, size))[1]
+
+def writeTree(database, fanouts, parentID=2):
+    """
+    Write a tree directly into TodoTask and ClosureTable under the task 'parentID' (the [default]
+    task by default). 'fanouts' gives the number of children per node at each level, e.g. [40, 50, 50].
+    Return (rowids of the first level, number of tasks written)
+    """
+
+    conn = database.connection()
+    gap = database.positionGap
+
+    (parentDepth,) = conn.execute("SELECT depth FROM TodoTask WHERE rowid = ?;", (parentID,)).fetchone()
+    ancestry = conn.execute("SELECT parentID, depth FROM ClosureTable WHERE childID = ?;", (parentID,)).fetchall()
+    (lastRowid,) = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM TodoTask;").fetchone()
+
+    ancestors = {parentID: ancestry}
+    nextRowid = lastRowid + 1
+    count = 0
+
+    # Bypass the per-row insert trigger, since the closure rows are written in bulk here
+    with database.transaction() as c:
+        c.execute("DROP TRIGGER IF EXISTS TodoTask_insert;")
+
+        # Breadth-first, one level at a time, so only the ancestry of the last level is kept
+        frontier = [parentID]
+        for (level, fanout) in enumerate(fanouts):
+            tasks = list()
+            closure = list()
+            newAncestors = dict()
+            for nodeID in frontier:
+                for position in range(1, fanout + 1):
+                    rowid = nextRowid
+                    nextRowid += 1
+
+                    tasks.append((rowid, nodeID, "task " + str(rowid), position * gap, parentDepth + level + 1))
+                    newAncestors[rowid] = [(rowid, 0)] + [(a, d + 1) for (a, d) in ancestors[nodeID]]
+                    closure.extend((a, rowid, d) for (a, d) in newAncestors[rowid])
+
+            c.executemany("INSERT INTO TodoTask (rowid, parentID, description, position, depth) VALUES (?, ?, ?, ?, ?);", tasks)
+            c.executemany("INSERT INTO ClosureTable (parentID, childID, depth) VALUES (?, ?, ?);", closure)
+
+            count += len(tasks)
+            ancestors = newAncestors
+            frontier = list(newAncestors)
+            if level == 0:
+                firstLevel = list(frontier)
+
+        c.execute(TodoDatabase.CREATE_TRIGGER_TODOTASK_INSERT)
+
+    return (firstLevel, count)
+
+def main():
+
+    if len(sys.argv) != 4:
+        print(__doc__.strip(), file=sys.stderr)
+        sys.exit(2)
+
+    (databasePath, shape, size) = sys.argv[1:]
+
+    with TodoDatabase(databasePath) as database:
+        count = writeShape(database, shape, int(size))
+
+    print("wrote " + str(count) + " tasks (" + shape + ") to " + databasePath)
+
+if  __name__ =='__main__':
+    main()
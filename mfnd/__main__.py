@@ -5,36 +5,139 @@ MFND - To-do list application
 
 """
 
-import os
+import time
+
+# Taken before anything else is imported, for --profile-startup
+importStart = time.perf_counter()
 
-from todoshell import TodoShell
-from database import TodoDatabase
-from tasktree import TaskTree
+import argparse
+import os
+import signal
+import sys
 
 
 def main():
 
-    # Initialize the database
-    database = initDatabase()
-    taskTree = TaskTree(database)
+    parser = argparse.ArgumentParser(prog="mfnd", description="A no-frills commandline to-do list")
+    parser.add_argument("-f", "--file", metavar="SCRIPT",
+        help="run the commands in SCRIPT ('-' for stdin), then print the list and exit")
+    parser.add_argument("--serve", action="store_true",
+        help="keep the list in memory and take commands from mfnd/client.py over a Unix socket")
+    parser.add_argument("--socket", metavar="PATH", default=defaultSocketPath(),
+        help="socket the server listens on (default data/mfnd.sock)")
+    parser.add_argument("--profile-startup", action="store_true",
+        help="report the time spent importing modules and loading the list, then exit")
+    parser.add_argument("--no-snapshot", action="store_true",
+        help="read the list from the database only, without the snapshot file data/todo_list.snapshot")
+    args = parser.parse_args()
+
+    # Commands piped in on stdin are run as a script too
+    if args.file == None and not args.serve and not args.profile_startup and not sys.stdin.isatty():
+        args.file = "-"
+
+    # Modules are imported only once the command line is known to be usable
+    from todoshell import TodoShell
+    from tasktree import TaskTree
+    timings = [("imports", importStart, time.perf_counter())]
+
+    # Initialize the database (its connection stays open until the shell exits)
+    with timed(timings, "open database", initDatabase, not args.no_snapshot) as database:
+        taskTree = timed(timings, "load task tree", TaskTree, database)
+        shell = timed(timings, "start shell", TodoShell, taskTree)
+
+        if args.profile_startup:
+            printStartupProfile(timings, taskTree)
+            return
+
+        if args.file != None:
+            if args.file == "-":
+                failures = shell.runScript(sys.stdin)
+            else:
+                with open(args.file) as f:
+                    failures = shell.runScript(f)
+            shell.close()
+            sys.exit(1 if failures else 0)
 
-    # Program main loop (REPL)
-    #   - Read commands from user
-    #   - Evaluate commands updating database
-    #   - Print current state of database
-    #   - Loop until exit command 
-    TodoShell(taskTree).cmdloop()
+        if args.serve:
+            serve(shell, args.socket)
+            return
 
+        # Program main loop (REPL)
+        #   - Read commands from user
+        #   - Evaluate commands updating database
+        #   - Print current state of database
+        #   - Loop until exit command
+        shell.cmdloop()
 
-def initDatabase():
+
+def timed(timings, name, function, *args):
+    """
+    Call 'function' with 'args', adding its (name, start, end) times to 'timings'. Return its result
+    """
+
+    start = time.perf_counter()
+    result = function(*args)
+    timings.append((name, start, time.perf_counter()))
+
+    return result
+
+def printStartupProfile(timings, taskTree):
     """
-    Initialize the to-do list database
+    Print how long each step of startup took, up to where the first prompt would be shown
     """
 
+    print("mfnd startup (ms):")
+    for (name, start, end) in timings:
+        print("    %-16s %8.2f" % (name, 1e3 * (end - start)))
+    print("    %-16s %8.2f" % ("total", 1e3 * (timings[-1][2] - timings[0][1])))
+    print()
+    print("    %d tasks in memory, schema version %d, loaded from %s" % (len(taskTree.nodeTable) - 2,
+        taskTree.database.schemaVersion(), "the snapshot" if taskTree.database.snapshotLoaded else "SQLite"))
+
+def serve(shell, socketPath):
+    """
+    Run the shell's commands for clients until the server is interrupted or terminated
+    """
+
+    from server import TodoServer
+
+    # SIGTERM unwinds like Ctrl-C, so the socket is removed and the history saved
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        server = TodoServer(socketPath, shell)
+    except OSError as err:
+        print("mfnd: cannot serve on " + socketPath + ": " + str(err), file=sys.stderr)
+        sys.exit(1)
+
+    print("MFND serving on " + socketPath)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shell.close()
+
+def defaultSocketPath():
+    """
+    Return the path of the server socket, next to the to-do list database
+    """
+
+    scriptPath = os.path.dirname(os.path.realpath(__file__))
+    return scriptPath + "/../data/mfnd.sock"
+
+def initDatabase(useSnapshot=True):
+    """
+    Initialize the to-do list database, with the snapshot file of its task tree next to it
+    """
+
+    from database import TodoDatabase
+
     scriptPath = os.path.dirname(os.path.realpath(__file__))
     databasePath = scriptPath + "/../data/todo_list.sqlite"
+    snapshotPath = scriptPath + "/../data/todo_list.snapshot" if useSnapshot else None
 
-    database = TodoDatabase(databasePath)
+    database = TodoDatabase(databasePath, snapshotPath=snapshotPath)
     return database
 
 if  __name__ =='__main__':
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+
+Thin client for a running mfnd server ('python3 mfnd --serve'). It only loads the standard
+socket module, so it starts in a few milliseconds
+
+Usage:  python3 mfnd/client.py [--socket PATH] [command ...]
+
+The command given as arguments is run, or else every command line read from stdin. The exit
+status is 1 if any command failed and 2 if no server is running, or it stopped mid-command
+
+"""
+
+import os
+import socket
+import sys
+
+
+DEFAULT_SOCKET = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "data", "mfnd.sock")
+
+
+def sendCommands(lines, socketPath=DEFAULT_SOCKET, out=sys.stdout):
+    """
+    Send command lines to the server one at a time and write out what each one printed. Return
+    the number of commands that failed
+    """
+
+    failures = 0
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socketPath)
+        replies = sock.makefile('r', encoding='utf-8')
+
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line == 'exit':
+                break
+
+            sock.sendall((line + "\n").encode('utf-8'))
+
+            reply = replies.readline()
+            if not reply:
+                raise ConnectionResetError("the server stopped before answering '" + line + "'")
+
+            (status, count) = reply.split()
+            for i in range(int(count)):
+                out.write(replies.readline())
+
+            if status != "OK":
+                failures += 1
+
+    return failures
+
+def main():
+
+    args = sys.argv[1:]
+    socketPath = DEFAULT_SOCKET
+    if len(args) >= 2 and args[0] == "--socket":
+        socketPath = args[1]
+        args = args[2:]
+
+    lines = [" ".join(args)] if args else sys.stdin
+
+    try:
+        failures = sendCommands(lines, socketPath)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("mfnd: no server is listening on " + socketPath + " (start one with 'python3 mfnd --serve')",
+            file=sys.stderr)
+        sys.exit(2)
+    except ConnectionResetError as err:
+        print("mfnd: " + str(err), file=sys.stderr)
+        sys.exit(2)
+
+    sys.exit(1 if failures else 0)
+
+if  __name__ =='__main__':
+    main()
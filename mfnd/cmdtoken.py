@@ -5,17 +5,30 @@ Module defining command tokens (Command Pattern) for use by the TodoShell CLI
 
 """
 
-from todotask import TodoTask
+import contextlib
 
 
 class CommandStack:
     """
-    Stack of command tokens that can be navigated forward and backward with undo/redo
+    Undo/redo history of executed commands. Each command is stored in the database with the 
+    TodoTask rows it inserted, deleted and updated, before and after (see 
+    TodoDatabase.stopRecording), so the history survives restarts and nothing but the cursor is 
+    kept in memory
     """
 
-    stack = list()
-    nextIndex = 0
-    maxIndex = 0
+    # At most this many commands can be undone. Older records are evicted at checkpoints, taken
+    # every 'checkpointInterval' commands and when the shell exits
+    capacity = 1000
+    checkpointInterval = 100
+
+    # Sequence numbers of the last applied record and of the oldest and newest stored records
+    cursor = 0
+    oldest = None
+    newest = None
+    sinceCheckpoint = 0
+
+    # CommandStats that command execution, undo and redo are measured into (see stats.py), if any
+    stats = None
 
     @staticmethod
     def setTaskTree(taskTree):
@@ -25,28 +38,82 @@ class CommandStack:
 
         CommandStack.taskTree = taskTree
 
+        # The cursor is changed as soon as a record is pushed, before the transaction around 
+        # the command commits. A rolled back transaction reloads the tree, and the cursor with it
+        if CommandStack.load not in taskTree.reloadCallbacks:
+            taskTree.reloadCallbacks.append(CommandStack.load)
+
+    @staticmethod
+    def load():
+        """
+        Read the position in the undo/redo history saved by an earlier session
+        """
+
+        (CommandStack.cursor, CommandStack.oldest, CommandStack.newest) = CommandStack.taskTree.database.historyBounds()
+        CommandStack.sinceCheckpoint = 0
+
+    @staticmethod
+    @contextlib.contextmanager
+    def recording(token):
+        """
+        Context manager around a command's changes, which are recorded row by row. Together with 
+        the command's history record they are committed in one transaction
+        """
+
+        database = CommandStack.taskTree.database
+
+        with CommandStack.measuring(type(token).__name__ + ".execute"), CommandStack.taskTree.batch():
+            database.startRecording()
+            yield
+            token.changes = database.stopRecording()
+            CommandStack.push(token)
+
     @staticmethod
-    def push(token, inredo):
+    def measuring(name):
         """
-        Add a new command token to the top of the stack
+        Return a context manager measuring the enclosed code as the command 'name' when 'stats' is set
         """
 
-        CommandStack.nextIndex += 1
+        if CommandStack.stats == None:
+            return contextlib.nullcontext()
 
-        if inredo == False:
-            CommandStack.stack.insert(CommandStack.nextIndex - 1, token)
-            CommandStack.maxIndex = CommandStack.nextIndex
+        return CommandStack.stats.measure(name)
 
     @staticmethod
-    def pop():
+    def push(token):
         """
-        Remove a command token from the top of the stack and return it
+        Add a command token's change set to the top of the history, discarding any undone 
+        commands above the cursor
         """
 
-        token = CommandStack.stack[CommandStack.nextIndex - 1]
-        CommandStack.nextIndex -= 1
+        seq = CommandStack.cursor + 1
+        CommandStack.taskTree.database.appendHistory(seq, type(token).__name__, encodeChanges(token.changes))
+
+        CommandStack.cursor = seq
+        CommandStack.newest = seq
+        if CommandStack.oldest == None:
+            CommandStack.oldest = seq
+
+        CommandStack.sinceCheckpoint += 1
+        if CommandStack.sinceCheckpoint >= CommandStack.checkpointInterval:
+            CommandStack.checkpoint()
+
+    @staticmethod
+    def checkpoint():
+        """
+        Evict the oldest history records beyond 'capacity', like a ring buffer
+        """
+
+        CommandStack.sinceCheckpoint = 0
+
+        if CommandStack.newest == None:
+            return
 
-        return token
+        # Records above the cursor are still needed for redo
+        keepFrom = min(CommandStack.newest - CommandStack.capacity + 1, CommandStack.cursor + 1)
+        if CommandStack.oldest < keepFrom:
+            CommandStack.taskTree.database.trimHistory(keepFrom)
+            CommandStack.oldest = keepFrom
 
     @staticmethod
     def undo():
@@ -54,11 +121,17 @@ class CommandStack:
         Roll back the previous command if possible. Return 'True' if possible.
         """
 
-        if CommandStack.nextIndex == 0:
-            return False
-        else:
-            CommandStack.pop().undo()            
-            return True
+        # The history is checked inside the transaction, once another connection's commands 
+        # have been read
+        with CommandStack.measuring("CommandStack.undo"), CommandStack.taskTree.batch():
+            if CommandStack.oldest == None or CommandStack.cursor < CommandStack.oldest:
+                return False
+            (command, changes) = CommandStack.taskTree.database.readHistory(CommandStack.cursor)
+            CommandStack.taskTree.applyChanges(decodeChanges(changes), undo=True)
+            CommandStack.taskTree.database.setHistoryCursor(CommandStack.cursor - 1)
+            CommandStack.cursor -= 1
+
+        return True
 
     @staticmethod
     def redo():
@@ -66,11 +139,34 @@ class CommandStack:
         Go forward from a previously undone command if possible. Return 'True' if possible.
         """
 
-        if CommandStack.nextIndex == CommandStack.maxIndex:
-            return False
-        else:
-            CommandStack.stack[CommandStack.nextIndex].execute(True)
-            return True
+        with CommandStack.measuring("CommandStack.redo"), CommandStack.taskTree.batch():
+            if CommandStack.newest == None or CommandStack.cursor >= CommandStack.newest:
+                return False
+            (command, changes) = CommandStack.taskTree.database.readHistory(CommandStack.cursor + 1)
+            CommandStack.taskTree.applyChanges(decodeChanges(changes))
+            CommandStack.taskTree.database.setHistoryCursor(CommandStack.cursor + 1)
+            CommandStack.cursor += 1
+
+        return True
+
+def encodeChanges(changes):
+    """
+    Return the text stored in a history record for a change set
+    """
+
+    # Imported on first use, as nothing before the first prompt needs it
+    import json
+
+    return json.dumps(changes, separators=(',', ':'))
+
+def decodeChanges(text):
+    """
+    Return the change set stored in a history record
+    """
+
+    import json
+
+    return json.loads(text)
 
 class TodoCommand:
     """
@@ -81,20 +177,13 @@ class TodoCommand:
 
         self.task = task
 
-    def execute(self, inredo=False):
+    def execute(self):
         """
         Execute this command
         """
 
-        self.label = CommandStack.taskTree.insertTask(self.task)
-        CommandStack.push(self, inredo)
-
-    def undo(self):
-        """
-        Undo this command
-        """
-
-        CommandStack.taskTree.deleteTask(self.label)
+        with CommandStack.recording(self):
+            self.label = CommandStack.taskTree.insertTask(self.task)
 
 class TodosubCommand:
     """
@@ -106,20 +195,13 @@ class TodosubCommand:
         self.task = task
         self.parentLabel = parentLabel
 
-    def execute(self, inredo=False):
+    def execute(self):
         """
         Execute this command
         """
 
-        self.label = CommandStack.taskTree.insertTask(self.task, self.parentLabel)
-        CommandStack.push(self, inredo)
-
-    def undo(self):
-        """
-        Undo this command
-        """
-
-        CommandStack.taskTree.deleteTask(self.label)
+        with CommandStack.recording(self):
+            self.label = CommandStack.taskTree.insertTask(self.task, self.parentLabel)
 
 class DoneCommand:
     """
@@ -130,20 +212,30 @@ class DoneCommand:
 
         self.label = label
 
-    def execute(self, inredo=False):
+    def execute(self):
         """
         Execute this command
         """
 
-        CommandStack.taskTree.setDone(self.label)
-        CommandStack.push(self, inredo)
+        with CommandStack.recording(self):
+            CommandStack.taskTree.setDoneTasks([self.label])
 
-    def undo(self):
+class BatchDoneCommand:
+    """
+    Class for 'done' commands on several tasks in todoshell
+    """
+
+    def __init__(self, labels):
+
+        self.labels = labels
+
+    def execute(self):
         """
-        Undo this command
+        Execute this command
         """
 
-        CommandStack.taskTree.setUndone(self.label)
+        with CommandStack.recording(self):
+            CommandStack.taskTree.setDoneTasks(self.labels)
 
 class RemoveCommand:
     """
@@ -154,20 +246,30 @@ class RemoveCommand:
 
         self.label = label
 
-    def execute(self, inredo=False):
+    def execute(self):
         """
         Execute this command
         """
 
-        self.trace = CommandStack.taskTree.deleteTask(self.label)
-        CommandStack.push(self, inredo)
+        with CommandStack.recording(self):
+            CommandStack.taskTree.deleteTask(self.label)
 
-    def undo(self):
+class BatchRemoveCommand:
+    """
+    Class for 'remove' commands on several tasks in todoshell
+    """
+
+    def __init__(self, labels):
+
+        self.labels = labels
+
+    def execute(self):
         """
-        Undo this command
+        Execute this command
         """
 
-        CommandStack.taskTree.insertTrace(self.trace)
+        with CommandStack.recording(self):
+            CommandStack.taskTree.deleteTasks(self.labels)
 
 class MoveUpCommand:
     """
@@ -178,20 +280,13 @@ class MoveUpCommand:
 
         self.label = label
 
-    def execute(self, inredo=False):
+    def execute(self):
         """
         Execute this command
         """
 
-        self.newLabel = CommandStack.taskTree.moveTaskUp(self.label)
-        CommandStack.push(self, inredo)
-
-    def undo(self):
-        """
-        Undo this command
-        """
-
-        CommandStack.taskTree.moveTaskDown(self.newLabel)
+        with CommandStack.recording(self):
+            CommandStack.taskTree.moveTaskUp(self.label)
 
 class MoveDownCommand:
     """
@@ -202,20 +297,13 @@ class MoveDownCommand:
 
         self.label = label
 
-    def execute(self, inredo=False):
+    def execute(self):
         """
         Execute this command
         """
 
-        self.newLabel = CommandStack.taskTree.moveTaskDown(self.label)
-        CommandStack.push(self, inredo)
-
-    def undo(self):
-        """
-        Undo this command
-        """
-
-        CommandStack.taskTree.moveTaskUp(self.newLabel)
+        with CommandStack.recording(self):
+            CommandStack.taskTree.moveTaskDown(self.label)
 
 class MoveTopCommand:
     """
@@ -226,39 +314,63 @@ class MoveTopCommand:
 
         self.label = label
 
-    def execute(self, inredo=False):
+    def execute(self):
         """
         Execute this command
         """
 
-        (self.newLabel, self.oldPosition) = CommandStack.taskTree.moveTask(self.label, 1)
-        CommandStack.push(self, inredo)
+        with CommandStack.recording(self):
+            CommandStack.taskTree.moveTask(self.label, 1)
+
+class MoveBottomCommand:
+    """
+    Class for 'move bottom' commands in todoshell
+    """
+
+    def __init__(self, label):
 
-    def undo(self):
+        self.label = label
+
+    def execute(self):
         """
-        Undo this command
+        Execute this command
         """
 
-        CommandStack.taskTree.moveTask(self.newLabel, self.oldPosition)
+        with CommandStack.recording(self):
+            CommandStack.taskTree.moveTaskBottom(self.label)
 
-class MoveBottomCommand:
+class MoveUnderCommand:
     """
-    Class for 'move bottom' commands in todoshell
+    Class for 'move under' commands in todoshell
     """
 
-    def __init__(self, label):
+    def __init__(self, label, parentLabel):
 
         self.label = label
+        self.parentLabel = parentLabel
 
-    def execute(self, inredo=False):
+    def execute(self):
         """
         Execute this command
         """
 
-        # self.newLabel = CommandStack.taskTree.moveTaskBottom(self.label)
-        # CommandStack.push(self, inredo)
+        with CommandStack.recording(self):
+            CommandStack.taskTree.moveTaskUnder(self.label, self.parentLabel)
+
+class BatchMoveUnderCommand:
+    """
+    Class for 'move under' commands on several tasks in todoshell
+    """
+
+    def __init__(self, labels, parentLabel):
 
-    def undo(self):
+        self.labels = labels
+        self.parentLabel = parentLabel
+
+    def execute(self):
         """
-        Undo this command
-        """
\ No newline at end of file
+        Execute this command
+        """
+
+        with CommandStack.recording(self):
+            CommandStack.taskTree.moveTasksUnder(self.labels, self.parentLabel)
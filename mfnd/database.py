@@ -5,21 +5,17 @@ Module for a database representing the to-do list
 
 """
 
+import os
 import time
 import sqlite3
+import threading
+import contextlib
 
+import snapshot
 from todotask import TodoTask
 from tasktree import TaskTree
 from tasktree import TreeNode
 
-def strSQLite(string):
-    """
-    Sanitizes input for SQLite TEXT fields by converting to string and replacing 
-    each single quote (') with two single quotes ('')
-    """
-
-    return str(string).replace(r"'", "''")
-
 class TodoDatabase:
     """
     Represents an SQLite database storing tasks in a to-do list
@@ -51,13 +47,9 @@ class TodoDatabase:
     '''
 
     CREATE_TRIGGER_TODOTASK_INSERT = '''
-    -- Increment TodoTask.position before INSERT --
+    -- Add ClosureTable entries after INSERT --
     CREATE TRIGGER IF NOT EXISTS TodoTask_insert AFTER INSERT ON TodoTask
     BEGIN
-        UPDATE TodoTask
-            SET position = position + 1
-            WHERE position >= new.position AND parentID = new.parentID AND rowid != new.rowid;
-
         INSERT INTO ClosureTable(
             parentID,
             childID,
@@ -83,26 +75,6 @@ class TodoDatabase:
     END;
     '''
 
-    CREATE_TRIGGER_TODOTASK_DELETE = '''
-    -- Decrement TodoTask.position after DELETE --
-    CREATE TRIGGER IF NOT EXISTS TodoTask_delete AFTER DELETE ON TodoTask
-    BEGIN
-        DELETE FROM ClosureTable
-        WHERE childID IN (
-            SELECT DISTINCT p.childID
-            FROM ClosureTable p, ClosureTable c
-            WHERE p.parentID = old.rowid AND c.childID = p.childID
-        );
-
-        DELETE FROM TodoTask 
-        WHERE parentID = old.rowid;
-
-        UPDATE TodoTask
-            SET position = position - 1
-            WHERE position > old.position AND parentID = old.parentID;
-    END;
-    '''
-
     INSERT_TODO_ROOT = '''
     INSERT INTO TodoTask (
         parentID,
@@ -122,12 +94,14 @@ class TodoDatabase:
         parentID,
         description,
         position,
-        completionStatus
+        completionStatus,
+        depth
     ) VALUES (
         1,
         '[default]',
         1,
-        'na'
+        'na',
+        1
     );
     '''
 
@@ -149,16 +123,637 @@ class TodoDatabase:
     );
     '''
 
+    def __rescalePositions(database, c):
+        """
+        Migration step turning the 1-based positions of older files into sort keys 'positionGap' apart
+        """
+
+        c.execute("UPDATE TodoTask SET position = position * ?;", (database.positionGap,))
+
+    # Numbered schema upgrades. MIGRATIONS[n - 1] upgrades a database from 'PRAGMA user_version'
+    # n - 1 to n, so existing to-do list files pick up new schema when they are next opened. Each 
+    # step is an SQL statement, or a function called with the database and a cursor when it 
+    # depends on the database's settings. Append new migrations to the end, never edit or 
+    # reorder the released ones.
+
+    MIGRATIONS = [
+        # 1: Indexes for sibling lookups and closure table ancestry/descendant queries
+        [
+            '''
+            CREATE INDEX IF NOT EXISTS TodoTask_parentID_position
+                ON TodoTask(parentID, position);
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS ClosureTable_parentID_depth
+                ON ClosureTable(parentID, depth, childID);
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS ClosureTable_childID
+                ON ClosureTable(childID, depth, parentID);
+            '''
+        ],
+        # 2: Subtrees are deleted set-wise by deleteTask() rather than by a recursive trigger
+        [
+            '''
+            DROP TRIGGER IF EXISTS TodoTask_delete;
+            '''
+        ],
+        # 3: TodoTask.position becomes a sparse sort key, so the insert trigger stops renumbering siblings
+        [
+            '''
+            DROP TRIGGER IF EXISTS TodoTask_insert;
+            ''',
+            CREATE_TRIGGER_TODOTASK_INSERT,
+            __rescalePositions
+        ],
+        # 4: Stored depth so the tree loads without aggregating ClosureTable (drops rows orphaned
+        #    by the old non-recursive delete trigger, which have no ClosureTable entries)
+        [
+            '''
+            DELETE FROM TodoTask WHERE rowid NOT IN (SELECT childID FROM ClosureTable);
+            ''',
+            '''
+            ALTER TABLE TodoTask ADD COLUMN depth INT NOT NULL DEFAULT 0;
+            ''',
+            '''
+            UPDATE TodoTask SET depth = (SELECT MAX(depth) FROM ClosureTable WHERE childID = TodoTask.rowid);
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS TodoTask_depth
+                ON TodoTask(depth, parentID, position);
+            '''
+        ],
+        # 5: Collapsible tasks, whose sub-tasks are only loaded when needed
+        [
+            '''
+            ALTER TABLE TodoTask ADD COLUMN collapsed INT NOT NULL DEFAULT 0;
+            '''
+        ],
+        # 6: Undo/redo history kept across sessions, as a bounded log of the row-level change 
+        #    set of each command
+        [
+            '''
+            CREATE TABLE IF NOT EXISTS History (
+                seq INTEGER PRIMARY KEY,
+                command TEXT NOT NULL,
+                changes TEXT NOT NULL
+            );
+            ''',
+            '''
+            ALTER TABLE ConfigTime ADD COLUMN historyCursor INT NOT NULL DEFAULT 0;
+            '''
+        ],
+        # 7: A change counter bumped by every write to TodoTask, whichever connection makes it,
+        #    which tags the snapshot file the tree can be loaded from (see snapshot.py)
+        [
+            '''
+            ALTER TABLE ConfigTime ADD COLUMN changeCounter INT NOT NULL DEFAULT 0;
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS TodoTask_count_insert AFTER INSERT ON TodoTask
+            BEGIN
+                UPDATE ConfigTime SET changeCounter = changeCounter + 1 WHERE id = 1;
+            END;
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS TodoTask_count_update AFTER UPDATE ON TodoTask
+            BEGIN
+                UPDATE ConfigTime SET changeCounter = changeCounter + 1 WHERE id = 1;
+            END;
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS TodoTask_count_delete AFTER DELETE ON TodoTask
+            BEGIN
+                UPDATE ConfigTime SET changeCounter = changeCounter + 1 WHERE id = 1;
+            END;
+            '''
+        ]
+    ]
+
+    # Parameterized statements. Each SQL string is fixed so sqlite3's statement cache
+    # parses and plans it once per connection and reuses it for every later call.
+
+    SELECT_CONFIGTIME = '''
+    SELECT pumpkinTime, lastInitTime FROM ConfigTime WHERE id = 1;
+    '''
+
+    UPDATE_LASTINITTIME = '''
+    UPDATE ConfigTime SET lastInitTime = ? WHERE id = 1;
+    '''
+
+    UPDATE_PUMPKINTIME = '''
+    UPDATE ConfigTime SET pumpkinTime = ? WHERE id = 1;
+    '''
+
+    SELECT_CHANGECOUNTER = '''
+    SELECT changeCounter FROM ConfigTime WHERE id = 1;
+    '''
+
+    SELECT_HISTORY_BOUNDS = '''
+    -- Undo/redo cursor and the oldest and newest history records --
+    SELECT
+        historyCursor,
+        (SELECT MIN(seq) FROM History),
+        (SELECT MAX(seq) FROM History)
+    FROM
+        ConfigTime
+    WHERE
+        id = 1;
+    '''
+
+    UPDATE_HISTORYCURSOR = '''
+    UPDATE ConfigTime SET historyCursor = ? WHERE id = 1;
+    '''
+
+    SELECT_HISTORY = '''
+    SELECT command, changes FROM History WHERE seq = ?;
+    '''
+
+    INSERT_HISTORY = '''
+    INSERT INTO History (seq, command, changes) VALUES (?, ?, ?);
+    '''
+
+    DELETE_HISTORY_AFTER = '''
+    DELETE FROM History WHERE seq > ?;
+    '''
+
+    DELETE_HISTORY_BEFORE = '''
+    DELETE FROM History WHERE seq < ?;
+    '''
+
+    INSERT_TASK = '''
+    INSERT INTO TodoTask (
+        parentID,
+        description,
+        position,
+        completionStatus,
+        depth
+    ) VALUES (
+        :parentID,
+        :description,
+        :position,
+        :completionStatus,
+        (SELECT depth + 1 FROM TodoTask WHERE rowid = :parentID)
+    );
+    '''
+
+    SELECT_TASKTREE = '''
+    -- Every task not hidden inside a collapsed task, parents before children and siblings in --
+    -- sort key order. The recursive step only descends through (parentID, position) lookups --
+    WITH RECURSIVE Visible (rowid, parentID, description, completionStatus, depth, position, collapsed) AS (
+        SELECT rowid, parentID, description, completionStatus, depth, position, collapsed
+            FROM TodoTask WHERE parentID IS NULL
+        UNION ALL
+        SELECT t.rowid, t.parentID, t.description, t.completionStatus, t.depth, t.position, t.collapsed
+            FROM Visible AS v JOIN TodoTask AS t ON t.parentID = v.rowid
+            WHERE v.collapsed = 0
+            ORDER BY 5, 2, 6
+    )
+    SELECT
+        rowid,
+        parentID,
+        description,
+        completionStatus,
+        depth,
+        collapsed
+    FROM
+        Visible;
+    '''
+
+    SELECT_SUBTREE = '''
+    -- Every descendant of a task, parents before children and siblings in sort key order --
+    SELECT
+        t.rowid,
+        t.parentID,
+        t.description,
+        t.completionStatus,
+        t.depth,
+        t.collapsed
+    FROM
+        ClosureTable AS c
+    JOIN
+        TodoTask AS t ON t.rowid = c.childID
+    WHERE
+        c.parentID = ? AND c.depth > 0
+    ORDER BY
+        t.depth ASC, t.parentID ASC, t.position ASC;
+    '''
+
+    UPDATE_COLLAPSED = '''
+    UPDATE TodoTask SET collapsed = ? WHERE rowid = ?;
+    '''
+
+    UPDATE_COMPLETIONSTATUS = '''
+    UPDATE TodoTask SET completionStatus = ? WHERE rowid = ?;
+    '''
+
+    CREATE_TEMP_SUBTREE = '''
+    -- Scratch set of rowids for subtree operations (private to each connection) --
+    CREATE TEMP TABLE IF NOT EXISTS Subtree (
+        rowid INTEGER PRIMARY KEY
+    );
+    '''
+
+    CLEAR_SUBTREE = '''
+    DELETE FROM temp.Subtree;
+    '''
+
+    COLLECT_SUBTREE = '''
+    INSERT OR IGNORE INTO temp.Subtree (rowid) SELECT childID FROM ClosureTable WHERE parentID = ?;
+    '''
+
+    DELETE_SUBTREE_TASKS = '''
+    DELETE FROM TodoTask WHERE rowid IN temp.Subtree;
+    '''
+
+    CREATE_TEMP_CHANGELOG = '''
+    -- Every TodoTask row written while a command is recorded, with its values before and after.
+    -- A NULL description (a NOT NULL column) marks a row that did not exist on that side --
+    CREATE TEMP TABLE IF NOT EXISTS ChangeLog (
+        seq INTEGER PRIMARY KEY,
+        taskID INT NOT NULL,
+        oldParentID INT,
+        oldDescription TEXT,
+        oldPosition INT,
+        oldCompletionStatus TEXT,
+        oldDepth INT,
+        oldCollapsed INT,
+        newParentID INT,
+        newDescription TEXT,
+        newPosition INT,
+        newCompletionStatus TEXT,
+        newDepth INT,
+        newCollapsed INT
+    );
+    '''
+
+    CREATE_TEMP_RECORDING = '''
+    -- Holds a row while the changes of a command are being recorded --
+    CREATE TEMP TABLE IF NOT EXISTS Recording (
+        active INT
+    );
+    '''
+
+    # Temporary triggers belong to the connection that creates them and may only name their
+    # temp tables unqualified
+
+    CREATE_TEMP_TRIGGER_RECORD_INSERT = '''
+    CREATE TEMP TRIGGER IF NOT EXISTS TodoTask_recordInsert AFTER INSERT ON main.TodoTask
+    WHEN EXISTS (SELECT 1 FROM Recording)
+    BEGIN
+        INSERT INTO ChangeLog (taskID, newParentID, newDescription, newPosition,
+            newCompletionStatus, newDepth, newCollapsed)
+        VALUES (new.rowid, new.parentID, new.description, new.position,
+            new.completionStatus, new.depth, new.collapsed);
+    END;
+    '''
+
+    CREATE_TEMP_TRIGGER_RECORD_UPDATE = '''
+    CREATE TEMP TRIGGER IF NOT EXISTS TodoTask_recordUpdate AFTER UPDATE ON main.TodoTask
+    WHEN EXISTS (SELECT 1 FROM Recording)
+    BEGIN
+        INSERT INTO ChangeLog (taskID, oldParentID, oldDescription, oldPosition,
+            oldCompletionStatus, oldDepth, oldCollapsed, newParentID, newDescription, newPosition,
+            newCompletionStatus, newDepth, newCollapsed)
+        VALUES (new.rowid, old.parentID, old.description, old.position,
+            old.completionStatus, old.depth, old.collapsed, new.parentID, new.description, new.position,
+            new.completionStatus, new.depth, new.collapsed);
+    END;
+    '''
+
+    CREATE_TEMP_TRIGGER_RECORD_DELETE = '''
+    CREATE TEMP TRIGGER IF NOT EXISTS TodoTask_recordDelete AFTER DELETE ON main.TodoTask
+    WHEN EXISTS (SELECT 1 FROM Recording)
+    BEGIN
+        INSERT INTO ChangeLog (taskID, oldParentID, oldDescription, oldPosition,
+            oldCompletionStatus, oldDepth, oldCollapsed)
+        VALUES (old.rowid, old.parentID, old.description, old.position,
+            old.completionStatus, old.depth, old.collapsed);
+    END;
+    '''
+
+    START_RECORDING = '''
+    INSERT INTO temp.Recording (active) VALUES (1);
+    '''
+
+    STOP_RECORDING = '''
+    DELETE FROM temp.Recording;
+    '''
+
+    SELECT_CHANGELOG = '''
+    SELECT
+        taskID,
+        oldParentID, oldDescription, oldPosition, oldCompletionStatus, oldDepth, oldCollapsed,
+        newParentID, newDescription, newPosition, newCompletionStatus, newDepth, newCollapsed
+    FROM
+        temp.ChangeLog
+    ORDER BY
+        seq;
+    '''
+
+    CLEAR_CHANGELOG = '''
+    DELETE FROM temp.ChangeLog;
+    '''
+
+    INSERT_CHANGED_TASK = '''
+    INSERT INTO TodoTask (
+        rowid,
+        parentID,
+        description,
+        position,
+        completionStatus,
+        depth,
+        collapsed
+    ) VALUES (?, ?, ?, ?, ?, ?, ?);
+    '''
+
+    UPDATE_CHANGED_TASK = '''
+    -- Collapsing is a view setting rather than a change, so the current state is kept --
+    UPDATE TodoTask SET description = ?, position = ?, completionStatus = ?, depth = ? WHERE rowid = ?;
+    '''
+
+    UPDATE_PARENT = '''
+    UPDATE TodoTask SET parentID = ? WHERE rowid = ?;
+    '''
+
+    DELETE_CHANGED_TASK = '''
+    DELETE FROM TodoTask WHERE rowid = ?;
+    '''
+
+    DELETE_TASK_CLOSURE = '''
+    DELETE FROM ClosureTable WHERE childID = :rowid OR parentID = :rowid;
+    '''
+
+    DELETE_SUBTREE_CLOSURE = '''
+    DELETE FROM ClosureTable WHERE childID IN temp.Subtree;
+    '''
+
+    SELECT_ANCESTORS = '''
+    SELECT parentID FROM ClosureTable WHERE childID = ? AND depth > 0 ORDER BY depth DESC;
+    '''
+
+    SELECT_PARENT_POSITION = '''
+    SELECT parentID, position FROM TodoTask WHERE rowid = ?;
+    '''
+
+    SELECT_NEIGHBOUR_KEYS = '''
+    SELECT position FROM TodoTask WHERE parentID = ? AND rowid != ? ORDER BY position LIMIT 2 OFFSET ?;
+    '''
+
+    SELECT_LAST_KEYS = '''
+    SELECT rowid, position FROM TodoTask WHERE parentID = ? ORDER BY position DESC LIMIT 2;
+    '''
+
+    SELECT_SIBLING_ROWIDS = '''
+    SELECT rowid FROM TodoTask WHERE parentID = ? AND rowid != ? ORDER BY position;
+    '''
+
+    SELECT_RANK = '''
+    -- 1-based display position of the sort key among its siblings --
+    SELECT COUNT(*) + 1 FROM TodoTask WHERE parentID = ? AND position < ?;
+    '''
+
+    UPDATE_POSITION = '''
+    UPDATE TodoTask SET position = ? WHERE rowid = ?;
+    '''
+
+    SELECT_IS_DESCENDANT = '''
+    SELECT COUNT(*) FROM ClosureTable WHERE parentID = ? AND childID = ?;
+    '''
+
+    UPDATE_PARENT_POSITION = '''
+    UPDATE TodoTask SET parentID = ?, position = ? WHERE rowid = ?;
+    '''
+
+    DELETE_SUBTREE_ANCESTRY = '''
+    -- Unlink a subtree from every ancestor outside of it --
+    DELETE FROM ClosureTable
+        WHERE childID IN (SELECT childID FROM ClosureTable WHERE parentID = :rowid)
+            AND parentID NOT IN (SELECT childID FROM ClosureTable WHERE parentID = :rowid);
+    '''
+
+    UPDATE_SUBTREE_DEPTH = '''
+    -- Shift the stored depth of a subtree to sit one level below its (new) parent --
+    UPDATE TodoTask
+        SET depth = depth + (SELECT depth + 1 FROM TodoTask WHERE rowid = :parentID)
+            - (SELECT depth FROM TodoTask WHERE rowid = :rowid)
+        WHERE rowid IN (SELECT childID FROM ClosureTable WHERE parentID = :rowid);
+    '''
+
+    INSERT_SUBTREE_ANCESTRY = '''
+    -- Link a subtree to every ancestor of its new parent --
+    INSERT INTO ClosureTable (
+        parentID,
+        childID,
+        depth
+    ) SELECT
+        p.parentID,
+        c.childID,
+        p.depth + c.depth + 1
+    FROM
+        ClosureTable AS p,
+        ClosureTable AS c
+    WHERE p.childID = :parentID AND c.parentID = :rowid;
+    '''
+
 
-    def __init__(self, databasePath):
+    FETCH_BATCH_SIZE = 1000
+
+    DEFAULT_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -8000,
+        'mmap_size': 0,
+        'foreign_keys': 'OFF'
+    }
+
+    def __init__(self, databasePath, cachedStatements=128, positionGap=1024, snapshotPath=None, **pragmas):
         """
         Initialize the database
+
+        'cachedStatements' sets the size of each connection's prepared statement cache. 
+        'positionGap' is the spacing between the sparse sort keys stored in TodoTask.position. 
+        'snapshotPath' names a snapshot file of the task tree (see snapshot.py) to load from when 
+        it is current and to save to with saveSnapshot(); None disables it. Keyword arguments 
+        override DEFAULT_PRAGMAS (e.g. synchronous='FULL', cache_size=-64000, mmap_size=268435456) 
+        and are applied to every connection this database opens
         """
 
         self.databasePath = databasePath
-        conn = sqlite3.connect(databasePath)
-        conn.isolation_level = None
-        c = conn.cursor()
+        self.snapshotPath = snapshotPath
+        self.cachedStatements = cachedStatements
+        self.positionGap = positionGap
+        self.pragmas = dict(self.DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas)
+
+        self.__local = threading.local()
+        self.__connections = list()
+        self.__connectionsLock = threading.Lock()
+        self.closed = False
+
+        # Counters for instrumentation (see stats.py): connections opened, SQL statements run 
+        # on them, including those run by triggers, while tracing is on, and TodoTask rows 
+        # changed. The latter leaves out ClosureTable, history and other bookkeeping rows
+        self.connectionCount = 0
+        self.statementCount = 0
+        self.rowsChanged = 0
+        self.tracing = False
+
+        # Change counter of the snapshot file last read or written, and whether the tree was last
+        # loaded from it
+        self.snapshotCounter = None
+        self.snapshotLoaded = False
+
+        # A database file already at the current schema version needs no DDL at all
+        version = self.connection().execute("PRAGMA user_version;").fetchone()[0]
+
+        # The schema, the reset check and recording this initialization share one transaction
+        with self.transaction() as c:
+            if version != len(self.MIGRATIONS):
+                self.__createSchema(c)
+
+            # If a reset point 'pumpkin time' is more recent than the last database initialization, 
+            # it's a new day therefore delete the entire TodoTask table
+            (resetDue, currentTime) = self.__isResetDue(c)
+            if resetDue:
+                self.__reset(c)
+
+            # Update the time of last initialization to current time 
+            c.execute(self.UPDATE_LASTINITTIME, (currentTime,))
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+
+        self.close()
+        return False
+
+    def connection(self):
+        """
+        Return the persistent connection owned by the calling thread, opening it on first use
+        """
+
+        if self.closed:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed TodoDatabase.")
+
+        conn = getattr(self.__local, 'connection', None)
+        if conn == None:
+            # Each connection is only used by its own thread, but close() closes them all from one
+            conn = sqlite3.connect(self.databasePath, cached_statements=self.cachedStatements,
+                check_same_thread=False)
+            conn.isolation_level = None
+            if self.tracing:
+                conn.set_trace_callback(self.__traceStatement)
+            for (name, value) in self.pragmas.items():
+                conn.execute("PRAGMA " + name + " = " + str(value) + ";")
+
+            conn.execute(self.CREATE_TEMP_SUBTREE)
+            conn.execute(self.CREATE_TEMP_CHANGELOG)
+            conn.execute(self.CREATE_TEMP_RECORDING)
+
+            self.__local.connection = conn
+            self.__local.depth = 0
+            with self.__connectionsLock:
+                self.__connections.append(conn)
+                self.connectionCount += 1
+
+        return conn
+
+    def setTracing(self, tracing):
+        """
+        Turn counting of SQL statements on or off, for the calling thread's connection and those 
+        opened later. The trace callback costs a few microseconds per statement, so it is off 
+        by default
+        """
+
+        self.tracing = tracing
+        self.connection().set_trace_callback(self.__traceStatement if tracing else None)
+
+    def __traceStatement(self, sql):
+        """
+        Count a statement run on one of the connections (their trace callback)
+        """
+
+        self.statementCount += 1
+
+    def begin(self):
+        """
+        Open a write transaction on the calling thread's connection. Nested calls open a savepoint
+        inside the outer transaction, so an inner scope can be rolled back on its own
+        """
+
+        conn = self.connection()
+        if self.__local.depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        else:
+            conn.execute("SAVEPOINT scope" + str(self.__local.depth))
+        self.__local.depth += 1
+
+    def commit(self):
+        """
+        Close the innermost transaction scope, committing when it is the outermost one
+        """
+
+        self.__local.depth -= 1
+        if self.__local.depth == 0:
+            self.__local.connection.execute("COMMIT")
+        else:
+            self.__local.connection.execute("RELEASE scope" + str(self.__local.depth))
+
+    def rollback(self):
+        """
+        Abandon the innermost transaction scope, or the whole transaction when it is the outermost one
+        """
+
+        if self.__local.depth > 0:
+            self.__local.depth -= 1
+            if self.__local.depth == 0:
+                self.__local.connection.execute("ROLLBACK")
+            else:
+                savepoint = "scope" + str(self.__local.depth)
+                self.__local.connection.execute("ROLLBACK TO " + savepoint)
+                self.__local.connection.execute("RELEASE " + savepoint)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Context manager running the enclosed statements in a single transaction
+        """
+
+        self.begin()
+        try:
+            yield self.__local.connection.cursor()
+        except:
+            self.rollback()
+            raise
+        self.commit()
+
+    def close(self):
+        """
+        Close every connection opened by this database
+        """
+
+        with self.__connectionsLock:
+            for conn in self.__connections:
+                conn.close()
+            self.__connections = list()
+
+        self.__local = threading.local()
+        self.closed = True
+
+    def schemaVersion(self):
+        """
+        Return the schema version recorded in the database file
+        """
+
+        return self.connection().execute("PRAGMA user_version;").fetchone()[0]
+
+    def __createSchema(self, c):
+        """
+        Create any missing tables, then bring older database files up to the current schema version
+        """
 
         # Create table TodoTask
         c.execute(self.CREATE_TABLE_TODOTASK)
@@ -166,217 +761,240 @@ class TodoDatabase:
         # Create table ClosureTable
         c.execute(self.CREATE_TABLE_CLOSURETABLE)
 
-        # Create a trigger to increment TodoTask.position before INSERT
+        # Create a trigger adding the ClosureTable rows of each inserted task
         c.execute(self.CREATE_TRIGGER_TODOTASK_INSERT)
 
-        # Create a trigger to decrement TodoTask.position after DELETE
-        c.execute(self.CREATE_TRIGGER_TODOTASK_DELETE)
-
         # Create table ConfigTime
         # Set the default pumpkinTime, but allow the possibility it was previously configured
         c.execute(self.CREATE_TABLE_CONFIGTIME)
         c.execute(self.SETUP_CONFIGTIME)
 
-        sql = '''
-        SELECT pumpkinTime FROM ConfigTime WHERE id = 1;
-        '''
-        result = c.execute(sql)
-        result_list = result.fetchall()  
-        pumpkinTime = int(result_list[0][0])
+        self.__migrate(c)
 
-        sql = '''
-        SELECT lastInitTime FROM ConfigTime WHERE id = 1;
-        '''
-        result = c.execute(sql)
-        result_list = result.fetchall()  
-        lastInitTime = int(result_list[0][0])
-
-        # Find the time of the most recent reset point based on the current time
-        (lastPumpkinTime, currentTime) = self.__getLastPumpkinTime(pumpkinTime)
+    def __migrate(self, c):
+        """
+        Apply every migration newer than the database's 'PRAGMA user_version', then record the new version
+        """
 
-        # Compute durations since last reset and since last database initialization
-        sincePumpkin = int(currentTime) - int(lastPumpkinTime)
-        sinceInit = int(currentTime) - int(lastInitTime)
+        version = c.execute("PRAGMA user_version;").fetchone()[0]
 
-        # If a reset point 'pumpkin time' is more recent than the last database initialization, 
-        # it's a new day therefore delete the entire TodoTask table
-        if sincePumpkin < sinceInit:
-            c.execute("BEGIN")
-            c.execute("DELETE FROM TodoTask;")
-            c.execute("DELETE FROM ClosureTable;")
-            c.execute("END")
+        for migration in self.MIGRATIONS[version:]:
+            for step in migration:
+                if callable(step):
+                    step(self, c)
+                else:
+                    c.execute(step)
 
-            # Add initial entries into TodoTask
-            c.execute(self.INSERT_TODO_ROOT)
-            c.execute(self.INSERT_TODO_DEFAULTMODE)
+        if version < len(self.MIGRATIONS):
+            c.execute("PRAGMA user_version = " + str(len(self.MIGRATIONS)) + ";")
 
-        # Update the time of last initialization to current time 
-        sql = '''
-        UPDATE ConfigTime SET lastInitTime = \'''' + strSQLite(currentTime) + '''\' WHERE id = 1;
-        '''
-        c.execute(sql)
+    def explainQueryPlan(self, sql, params=()):
+        """
+        Return the 'detail' column of EXPLAIN QUERY PLAN for a statement, one string per plan step
+        """
 
-        conn.commit()
-        conn.close()
+        return [row[3] for row in self.connection().execute("EXPLAIN QUERY PLAN " + sql, params)]
 
     def initializeTaskTree(self, taskTree):
         """
-        Initialize the task tree from the database
+        Initialize the task tree from the database. Sub-tasks of collapsed tasks are left out
         """
 
-        conn = sqlite3.connect(self.databasePath)
-        c = conn.cursor()
+        c = self.connection().cursor()
+        c.arraysize = self.FETCH_BATCH_SIZE
+        self.__local.dataVersion = c.execute("PRAGMA data_version;").fetchone()[0]
 
-        sql = '''
-        SELECT 
-            rowid,
-            parentID,
-            description,
-            position,
-            completionStatus,
-            maxDepth
-        FROM
-            TodoTask AS t
-        LEFT JOIN (
-            SELECT
-                childID,
-                MAX(depth) AS maxDepth
-            FROM
-                ClosureTable
-            GROUP BY childID
-        )
-        ON
-            rowid = childID
-        ORDER BY
-            maxDepth ASC, position ASC;
-        '''
-
-        for row in c.execute(sql):
-            rowid = row[0]
-            parentID = row[1]
-            description = row[2]
-            position = row[3]
-            completionStatus = row[4]
-            maxDepth = row[5]
-
-            task = TodoTask(description, position, completionStatus)
-            node = TreeNode(rowid, parentID, task, maxDepth)
-            taskTree.insertNode(node)
-
-        conn.commit()
-        conn.close()
+        # A snapshot tagged with the current change counter holds the same tree, so the rows 
+        # need not be read at all
+        self.snapshotLoaded = False
+        if self.snapshotPath != None:
+            changeCounter = c.execute(self.SELECT_CHANGECOUNTER).fetchone()[0]
+            if snapshot.readSnapshot(self.snapshotPath, taskTree, len(self.MIGRATIONS), changeCounter):
+                self.snapshotCounter = changeCounter
+                self.snapshotLoaded = True
+                return
 
-    def insertTask(self, task, parentID):
+        c.execute(self.SELECT_TASKTREE)
+
+        self.__insertNodes(c, taskTree)
+
+    def saveSnapshot(self, taskTree):
         """
-        Insert a new task object into the database
+        Write the task tree to the snapshot file, unless it is already current. Return 'True' if 
+        the snapshot file is current afterwards
         """
 
-        ########
-        if task.position == None:
-            print("insertTask() position = None")
-        else:
-            print("insertTask() position = " + str(task.position))
-        ########
+        if self.snapshotPath == None:
+            return False
 
-        if task.position == None:
-            positionSQL = '(SELECT COALESCE(MAX(position), 0) FROM TodoTask WHERE parentID = ' + strSQLite(parentID) + ') + 1'
-        else:
-            positionSQL = strSQLite(task.position)
+        changeCounter = self.connection().execute(self.SELECT_CHANGECOUNTER).fetchone()[0]
+        if changeCounter == self.snapshotCounter:
+            return True
 
-        conn = sqlite3.connect(self.databasePath)
-        c = conn.cursor()
+        # Checked after reading the counter: if no other connection has committed since the tree 
+        # was read, the counter only counts changes the tree already holds
+        if self.hasExternalChanges():
+            return False
 
-        sql = '''
-        INSERT INTO TodoTask (
-            parentID,
-            description,
-            position,
-            completionStatus
-        ) VALUES (
-            ''' + strSQLite(parentID) + ''',
-            \'''' + strSQLite(task.description) + '''\',
-            ''' + strSQLite(positionSQL) + ''',
-            \'''' + strSQLite(task.completionStatus) + '''\'
-        );
-        '''
-        c.execute(sql)
-
-        sql = '''
-        SELECT last_insert_rowid() FROM TodoTask;
-        '''
-        rowid = 0
-        for row in c.execute(sql):
-            rowid = row[0]
-            break
-
-        sql = '''
-        SELECT position FROM TodoTask WHERE rowid = ''' + strSQLite(rowid) + ''';
-        '''
-        for row in c.execute(sql):
-            task.position = row[0]
-            break
-
-        conn.commit()
-        conn.close()
+        if not snapshot.writeSnapshot(self.snapshotPath, taskTree, len(self.MIGRATIONS), changeCounter):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.snapshotPath)
+            return False
 
-        return rowid
+        self.snapshotCounter = changeCounter
+        return True
+
+    def initializeSubtree(self, taskTree, rowid):
+        """
+        Add every descendant of the task 'rowid' to the task tree, e.g. when a collapsed task is needed
+        """
+
+        c = self.connection().cursor()
+        c.arraysize = self.FETCH_BATCH_SIZE
+        c.execute(self.SELECT_SUBTREE, (rowid,))
 
-    # def insertTree(self, tree):
-    #     """
-    #     Insert a tree of task objects into the database
-    #     """
+        self.__insertNodes(c, taskTree)
+
+    def __insertNodes(self, c, taskTree):
+        """
+        Build a TreeNode for each row of an executed tree query and insert it into the task tree
+        """
 
-    #     self.insertTreeNode(tree.root, tree.position, tree.parentID)
+        # TodoTask.position holds sparse sort keys; rows arrive in key order within each parent,
+        # so counting children gives the 1-based display positions used for labels
+        positions = dict()
 
-    # def insertTreeNode(self, node, position, parentID):
-    #     """
-    #     Insert a tree node into the database
-    #     """
+        rows = c.fetchmany()
+        while rows:
+            for (rowid, parentID, description, completionStatus, depth, collapsed) in rows:
+                position = positions.get(parentID, 0) + 1
+                positions[parentID] = position
 
-    #     rowid = self.insertTask(node.task, position, None, parentID)
-    #     childNodes = node.children
+                task = TodoTask(description, position, completionStatus)
+                node = TreeNode(rowid, parentID, task, depth, collapsed != 0)
+                taskTree.insertNode(node)
 
-    #     index = 1
-    #     for child in childNodes:
-    #         self.insertTreeNode(child, index, rowid)
-    #         index += 1
+            rows = c.fetchmany()
+
+    def hasExternalChanges(self):
+        """
+        Return 'True' if another connection has committed to the database since initializeTaskTree()
+        last ran on this thread. Commits made through this connection are not counted
+        """
+
+        dataVersion = self.connection().execute("PRAGMA data_version;").fetchone()[0]
+        return dataVersion != getattr(self.__local, 'dataVersion', None)
+
+    def insertTask(self, task, parentID):
+        """
+        Insert a new task object into the database
+        """
+
+        params = {
+            'parentID': parentID,
+            'description': task.description,
+            'position': task.position,
+            'completionStatus': task.completionStatus
+        }
+
+        with self.transaction() as c:
+            params['position'] = self.__keyForPosition(c, parentID, task.position)
+            c.execute(self.INSERT_TASK, params)
+            rowid = c.lastrowid
+            task.position = c.execute(self.SELECT_RANK, (parentID, params['position'])).fetchone()[0]
+
+        return rowid
 
     def updateCompletionStatus(self, rowid, completionStatus):
         """
         Update 'completionStatus' for the task entry in the database under 'rowid'
         """
 
-        conn = sqlite3.connect(self.databasePath)
-        c = conn.cursor()
+        with self.transaction() as c:
+            c.execute(self.UPDATE_COMPLETIONSTATUS, (completionStatus, rowid))
+
+        return rowid
+
+    def setCollapsed(self, rowid, collapsed):
+        """
+        Record whether the task under 'rowid' is shown collapsed
+        """
 
-        sql = '''
-        UPDATE TodoTask
-            SET completionStatus = \'''' + completionStatus + '''\'
-            WHERE rowid == ''' + strSQLite(rowid) + ''' ;
-        '''
-        c.execute(sql)
+        with self.transaction() as c:
+            c.execute(self.UPDATE_COLLAPSED, (1 if collapsed else 0, rowid))
+            self.rowsChanged += c.rowcount
 
-        conn.commit()
-        conn.close()
+    def updateCompletionStatuses(self, rowids, completionStatus):
+        """
+        Update 'completionStatus' for every task entry in 'rowids' in one transaction
+        """
 
-        return rowid
+        with self.transaction() as c:
+            c.executemany(self.UPDATE_COMPLETIONSTATUS, [(completionStatus, rowid) for rowid in rowids])
 
     def deleteTask(self, rowid):
         """
-        Delete a task entry from the database
+        Delete a task and all of its sub-tasks from the database
+        """
+
+        self.deleteTasks([rowid])
+
+    def deleteTasks(self, rowids):
+        """
+        Delete several tasks and all of their sub-tasks from the database in one transaction. The 
+        subtrees are collected from ClosureTable and removed with one bulk DELETE per table. Sort 
+        keys are sparse, so the remaining siblings keep their keys
+        """
+
+        with self.transaction() as c:
+            c.execute(self.CLEAR_SUBTREE)
+            c.executemany(self.COLLECT_SUBTREE, [(rowid,) for rowid in rowids])
+            c.execute(self.DELETE_SUBTREE_TASKS)
+            c.execute(self.DELETE_SUBTREE_CLOSURE)
+            c.execute(self.CLEAR_SUBTREE)
+
+    def moveTask(self, rowid, position):
+        """
+        Move a task to display 'position' among its siblings by giving it a new sort key. Rowids, 
+        ClosureTable entries and the other siblings are left untouched. Return the task's 
+        (oldPosition, newPosition)
+        """
+
+        with self.transaction() as c:
+            (parentID, key) = c.execute(self.SELECT_PARENT_POSITION, (rowid,)).fetchone()
+            oldPosition = c.execute(self.SELECT_RANK, (parentID, key)).fetchone()[0]
+
+            position = max(1, position)
+            if position == oldPosition:
+                return (oldPosition, oldPosition)
+
+            key = self.__keyForPosition(c, parentID, position, rowid)
+            c.execute(self.UPDATE_POSITION, (key, rowid))
+            newPosition = c.execute(self.SELECT_RANK, (parentID, key)).fetchone()[0]
+
+        return (oldPosition, newPosition)
+
+    def reparentTask(self, rowid, parentID, position=None):
+        """
+        Move the subtree rooted at 'rowid' under the task 'parentID' with a closure table splice. 
+        Without 'position' it becomes the last child. Return its (oldParentID, oldPosition, newPosition)
         """
 
-        conn = sqlite3.connect(self.databasePath)
-        c = conn.cursor()
+        with self.transaction() as c:
+            if c.execute(self.SELECT_IS_DESCENDANT, (rowid, parentID)).fetchone()[0] > 0:
+                raise TodoDatabase.TaskIndexException("Cannot move a task under itself or its own sub-tasks")
 
-        sql = '''
-        DELETE FROM TodoTask
-            WHERE rowid == ''' + strSQLite(rowid) + ''' ;
-        '''
-        c.execute(sql)
+            (oldParentID, key) = c.execute(self.SELECT_PARENT_POSITION, (rowid,)).fetchone()
+            oldPosition = c.execute(self.SELECT_RANK, (oldParentID, key)).fetchone()[0]
 
-        conn.commit()
-        conn.close()
+            key = self.__keyForPosition(c, parentID, position, rowid)
+            c.execute(self.UPDATE_SUBTREE_DEPTH, {'rowid': rowid, 'parentID': parentID})
+            c.execute(self.UPDATE_PARENT_POSITION, (parentID, key, rowid))
+            c.execute(self.DELETE_SUBTREE_ANCESTRY, {'rowid': rowid})
+            c.execute(self.INSERT_SUBTREE_ANCESTRY, {'rowid': rowid, 'parentID': parentID})
+            newPosition = c.execute(self.SELECT_RANK, (parentID, key)).fetchone()[0]
+
+        return (oldParentID, oldPosition, newPosition)
 
     def configurePumpkinTime(self, timeInHours):
         """
@@ -387,20 +1005,235 @@ class TodoDatabase:
         mins = int(timeInHours[2:]) % 60
         timeInSecs = 60*60*hours + 60*mins
 
-        conn = sqlite3.connect(self.databasePath)
-        c = conn.cursor()
-
-        sql = '''
-        UPDATE ConfigTime SET pumpkinTime = \'''' + strSQLite(timeInSecs) + '''\' WHERE id = 1;
-        '''
-        c.execute(sql)
-
-        conn.commit()
-        conn.close()
+        with self.transaction() as c:
+            c.execute(self.UPDATE_PUMPKINTIME, (timeInSecs,))
 
         print("New pumpkin time: " + timeInHours)
         print()
 
+    def historyBounds(self):
+        """
+        Return the undo/redo (cursor, oldest, newest) history sequence numbers. The oldest and
+        newest are None when there is no history
+        """
+
+        return self.connection().execute(self.SELECT_HISTORY_BOUNDS).fetchone()
+
+    def readHistory(self, seq):
+        """
+        Return the (command, changes) history record 'seq', or None if there is none
+        """
+
+        return self.connection().execute(self.SELECT_HISTORY, (seq,)).fetchone()
+
+    def appendHistory(self, seq, command, changes):
+        """
+        Store history record 'seq' in place of any records after it and move the cursor to it
+        """
+
+        with self.transaction() as c:
+            c.execute(self.DELETE_HISTORY_AFTER, (seq - 1,))
+            c.execute(self.INSERT_HISTORY, (seq, command, changes))
+            c.execute(self.UPDATE_HISTORYCURSOR, (seq,))
+
+    def setHistoryCursor(self, seq):
+        """
+        Record the sequence number of the last history record that is applied
+        """
+
+        with self.transaction() as c:
+            c.execute(self.UPDATE_HISTORYCURSOR, (seq,))
+
+    def trimHistory(self, seq):
+        """
+        Delete the history records older than 'seq'
+        """
+
+        with self.transaction() as c:
+            c.execute(self.DELETE_HISTORY_BEFORE, (seq,))
+
+    def startRecording(self):
+        """
+        Start logging every TodoTask row this connection writes. Call inside the transaction 
+        of the changes, so that rolling it back also ends the recording
+        """
+
+        conn = self.connection()
+        if not getattr(self.__local, 'recorder', False):
+            conn.execute(self.CREATE_TEMP_TRIGGER_RECORD_INSERT)
+            conn.execute(self.CREATE_TEMP_TRIGGER_RECORD_UPDATE)
+            conn.execute(self.CREATE_TEMP_TRIGGER_RECORD_DELETE)
+            self.__local.recorder = True
+
+        conn.execute(self.CLEAR_CHANGELOG)
+        conn.execute(self.START_RECORDING)
+
+    def stopRecording(self):
+        """
+        Stop logging and return the change set written since startRecording(), in order. Each 
+        change is [rowid, before, after] where 'before' and 'after' are the row's [parentID, 
+        description, position, completionStatus, depth, collapsed], or None where the row does 
+        not exist
+        """
+
+        conn = self.connection()
+        changes = list()
+        for row in conn.execute(self.SELECT_CHANGELOG):
+            before = list(row[1:7]) if row[2] != None else None
+            after = list(row[7:13]) if row[8] != None else None
+            changes.append([row[0], before, after])
+
+        conn.execute(self.STOP_RECORDING)
+        conn.execute(self.CLEAR_CHANGELOG)
+        self.rowsChanged += len(set(change[0] for change in changes))
+
+        return changes
+
+    def applyChanges(self, changes, undo=False):
+        """
+        Replay a change set from stopRecording() in one transaction: in order to redo it, or in 
+        reverse with the 'before' values to undo it. The cost is proportional to the rows it 
+        touches, and ClosureTable follows every change of parent
+        """
+
+        if undo:
+            steps = [(rowid, after, before) for (rowid, before, after) in reversed(changes)]
+        else:
+            steps = changes
+        self.rowsChanged += len(set(change[0] for change in changes))
+
+        # Rows that come back are inserted first, parents before children, so the insert trigger 
+        # links each one below its parent whatever order they were recorded in
+        inserted = sorted((new[4], rowid, new) for (rowid, old, new) in steps if old == None and new != None)
+
+        with self.transaction() as c:
+            c.executemany(self.INSERT_CHANGED_TASK, [(rowid, new[0], new[1], new[2], new[3], depth, new[5])
+                for (depth, rowid, new) in inserted])
+
+            for (rowid, old, new) in steps:
+                if old == None:
+                    continue
+
+                if new == None:
+                    c.execute(self.DELETE_CHANGED_TASK, (rowid,))
+                    c.execute(self.DELETE_TASK_CLOSURE, {'rowid': rowid})
+                    continue
+
+                c.execute(self.UPDATE_CHANGED_TASK, (new[1], new[2], new[3], new[4], rowid))
+                if old[0] != new[0]:
+                    c.execute(self.UPDATE_PARENT, (new[0], rowid))
+                    c.execute(self.DELETE_SUBTREE_ANCESTRY, {'rowid': rowid})
+                    if new[0] != None:
+                        c.execute(self.INSERT_SUBTREE_ANCESTRY, {'rowid': rowid, 'parentID': new[0]})
+
+    def rankOf(self, parentID, key):
+        """
+        Return the 1-based display position of the sort key 'key' among the sub-tasks of 'parentID'
+        """
+
+        return self.connection().execute(self.SELECT_RANK, (parentID, key)).fetchone()[0]
+
+    def ancestorIDs(self, rowid):
+        """
+        Return the rowids of the ancestors of the task 'rowid', the root first
+        """
+
+        return [parentID for (parentID,) in self.connection().execute(self.SELECT_ANCESTORS, (rowid,))]
+
+    def __keyForPosition(self, c, parentID, position, rowid=None):
+        """
+        Return a sort key that places a task at display 'position' among the children of 'parentID'
+        (after the last child when None). Only the neighbouring keys are read; the siblings are
+        respaced only when two neighbours have no room left between them. 'rowid' is ignored as a
+        sibling so a task can be repositioned among its current siblings
+        """
+
+        exclude = -1 if rowid == None else rowid
+
+        if position != None:
+            offset = max(position - 2, 0)
+            keys = [row[0] for row in c.execute(self.SELECT_NEIGHBOUR_KEYS, (parentID, exclude, offset))]
+
+            if position <= 1 and len(keys) > 0:
+                return keys[0] - self.positionGap
+            elif position > 1 and len(keys) == 2:
+                (before, after) = keys
+                if after - before > 1:
+                    return (before + after) // 2
+                return self.__respace(c, parentID, position, exclude)
+
+        for (siblingID, key) in c.execute(self.SELECT_LAST_KEYS, (parentID,)).fetchall():
+            if siblingID != exclude:
+                return key + self.positionGap
+
+        return self.positionGap
+
+    def __respace(self, c, parentID, position, exclude):
+        """
+        Rewrite the sort keys of a parent's children 'positionGap' apart, leaving the slot at display 
+        'position' free. Return the key of that free slot
+        """
+
+        siblings = [row[0] for row in c.execute(self.SELECT_SIBLING_ROWIDS, (parentID, exclude)).fetchall()]
+
+        params = list()
+        for (index, siblingID) in enumerate(siblings):
+            slot = index + 1 if index + 1 < position else index + 2
+            params.append((slot * self.positionGap, siblingID))
+        c.executemany(self.UPDATE_POSITION, params)
+
+        return position * self.positionGap
+
+    def resetIfDue(self):
+        """
+        Clear the to-do list if a reset point (pumpkin time) has passed since the database was 
+        last initialized, as opening the database does. For processes that keep it open across 
+        days. Return 'True' if the list was cleared
+        """
+
+        if not self.__isResetDue(self.connection().cursor())[0]:
+            return False
+
+        with self.transaction() as c:
+            (resetDue, currentTime) = self.__isResetDue(c)
+            if resetDue:
+                self.__reset(c)
+                c.execute(self.UPDATE_LASTINITTIME, (currentTime,))
+
+        return resetDue
+
+    def __isResetDue(self, c):
+        """
+        Return whether a reset point is more recent than the last initialization, and the current time
+        """
+
+        row = c.execute(self.SELECT_CONFIGTIME).fetchone()
+        pumpkinTime = int(row[0])
+        lastInitTime = int(row[1])
+
+        # Find the time of the most recent reset point based on the current time
+        (lastPumpkinTime, currentTime) = self.__getLastPumpkinTime(pumpkinTime)
+
+        # Compute durations since last reset and since last database initialization
+        sincePumpkin = int(currentTime) - int(lastPumpkinTime)
+        sinceInit = int(currentTime) - int(lastInitTime)
+
+        return (sincePumpkin < sinceInit, currentTime)
+
+    def __reset(self, c):
+        """
+        Delete every task and the undo/redo history, leaving only the root and [default] tasks
+        """
+
+        c.execute("DELETE FROM TodoTask;")
+        c.execute("DELETE FROM ClosureTable;")
+        c.execute("DELETE FROM History;")
+        c.execute(self.UPDATE_HISTORYCURSOR, (0,))
+
+        # Add initial entries into TodoTask
+        c.execute(self.INSERT_TODO_ROOT)
+        c.execute(self.INSERT_TODO_DEFAULTMODE)
+
     def __getLastPumpkinTime(self, pumpkinTime):
         """
         Return the time of the most recent reset point (pumpkin time) and the current time it is relative to
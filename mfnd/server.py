@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+
+Module for running mfnd as a resident server, which keeps the to-do list in memory and takes
+todoshell commands from clients (see client.py) over a Unix socket
+
+"""
+
+import contextlib
+import io
+import os
+import queue
+import socket
+import socketserver
+import threading
+
+
+class TodoServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Line-based server for todoshell commands. Each client connection is read on a thread of its
+    own, but every command runs on the thread that calls serve(), one at a time: writes from
+    concurrent clients are serialized, and the TaskTree and the database connection never leave
+    that thread.
+
+    Protocol: the client sends one command per line. The server answers each one with a status
+    line, "OK <n>" or "ERR <n>" when the command failed, followed by the <n> lines the command
+    printed. A line 'exit' closes the client's connection; the server keeps running, and refuses 
+    any other command that would end the shell
+    """
+
+    daemon_threads = True
+
+    # Verbs that would end the shell, and with it the server every client shares
+    EXIT_COMMANDS = ('exit', 'EOF', 'quit')
+
+    # Seconds the command thread waits for a command before checking for signals again
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, socketPath, shell):
+        """
+        Listen on 'socketPath' for commands to run in a TodoShell
+        """
+
+        self.socketPath = socketPath
+        self.shell = shell
+        self.commands = queue.Queue()
+
+        removeStaleSocket(socketPath)
+        super().__init__(socketPath, CommandHandler)
+
+    def serve(self):
+        """
+        Accept clients in the background and run their commands on this thread until interrupted
+        """
+
+        listener = threading.Thread(target=self.serve_forever, daemon=True)
+        listener.start()
+
+        try:
+            while True:
+                # A signal can be delivered to any thread, but its Python handler only runs on 
+                # this one, once it stops waiting
+                try:
+                    (line, reply) = self.commands.get(timeout=self.POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                reply.put(self.runCommand(line))
+        finally:
+            self.shutdown()
+            self.server_close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.socketPath)
+
+    def submit(self, line):
+        """
+        Queue a command line for the command thread and wait for its (ok, output)
+        """
+
+        reply = queue.Queue(maxsize=1)
+        self.commands.put((line, reply))
+
+        return reply.get()
+
+    def runCommand(self, line):
+        """
+        Run one command line in the shell. Return whether it succeeded and what it printed
+        """
+
+        shell = self.shell
+        taskTree = shell.taskTree
+        warnings = shell.warnings
+        output = io.StringIO()
+
+        if shell.parseline(line)[0] in self.EXIT_COMMANDS:
+            return (False, "!!! Error '" + line + "' failed: clients cannot stop the server\n")
+
+        # The shell streams long listings to its own stdout rather than through print()
+        (shellStdout, shell.stdout) = (shell.stdout, output)
+
+        with contextlib.redirect_stdout(output):
+            try:
+                # The server may outlive the day its list was opened on
+                if taskTree.database.resetIfDue():
+                    taskTree.readDatabase()
+
+                shell.onecmd(line)
+                ok = shell.warnings == warnings
+            except Exception as err:
+                print("!!! Error '" + line + "' failed: " + type(err).__name__ + " " + str(err))
+                ok = False
+            finally:
+                shell.stdout = shellStdout
+
+        return (ok, output.getvalue())
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """
+    Read command lines from one client and write back the result of each
+    """
+
+    def handle(self):
+
+        for data in self.rfile:
+            line = data.decode('utf-8').strip()
+            if line == 'exit':
+                break
+
+            if not line or line.startswith('#'):
+                (ok, output) = (True, "")
+            else:
+                (ok, output) = self.server.submit(line)
+
+            lines = output.splitlines()
+            status = ("OK " if ok else "ERR ") + str(len(lines))
+            self.wfile.write("".join(text + "\n" for text in [status] + lines).encode('utf-8'))
+
+def removeStaleSocket(socketPath):
+    """
+    Remove a socket file left behind by a server that is no longer running. Raise OSError if a
+    server is still listening on it
+    """
+
+    if not os.path.exists(socketPath):
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socketPath)
+        except ConnectionRefusedError:
+            os.unlink(socketPath)
+            return
+
+    raise OSError("another mfnd server is listening on it")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+
+Module for the snapshot file of the task tree: a compact binary copy of the tree as it is loaded
+at startup, tagged with the database's change counter. A current snapshot is read with a single
+mmap instead of querying and decoding every TodoTask row
+
+"""
+
+import array
+import gc
+import mmap
+import os
+import struct
+
+from todotask import TodoTask
+from tasktree import TreeNode
+
+
+MAGIC = b'MFNDSNAP'
+FORMAT_VERSION = 1
+
+# Written in native byte order, so a file from a machine of the other endianness reads as stale
+BYTE_ORDER_MARK = 0x0102030405060708
+
+# magic, format version, schema version, change counter, node count, index of the [default]
+# task, number of distinct completion statuses, size of the text block, byte order mark
+HEADER = struct.Struct('=8sIIqqqqqq')
+HEADER_SIZE = 80
+
+# Typecodes of the per-node arrays following the header: rowid, parentID, position, depth,
+# number of children, completion status and flags. Ordered by item size, so each array starts
+# aligned for its type
+COLUMNS = ('q', 'q', 'i', 'i', 'i', 'B', 'B')
+NODE_SIZE = sum(array.array(typecode).itemsize for typecode in COLUMNS)
+
+# Node flags
+COLLAPSED = 1
+INDEXED = 2
+
+SEPARATOR = '\0'
+
+
+def writeSnapshot(path, taskTree, schemaVersion, changeCounter):
+    """
+    Write the tasks of 'taskTree' that are not hidden inside a collapsed task to the snapshot
+    file at 'path', replacing it atomically. Return 'False' if the tree cannot be stored, which
+    only happens when a description contains a NUL character
+    """
+
+    # Breadth-first, so the children of each node are contiguous and follow their parent
+    nodes = [taskTree.root]
+    for node in nodes:
+        if not node.collapsed:
+            nodes.extend(node.children)
+
+    labelTable = taskTree.labelTable
+    statuses = sorted(set(node.task.completionStatus for node in nodes))
+    statusIndex = dict((status, index) for (index, status) in enumerate(statuses))
+
+    texts = statuses + [node.task.description for node in nodes] + [node.label for node in nodes]
+    text = SEPARATOR.join(texts)
+    if text.count(SEPARATOR) != len(texts) - 1 or len(statuses) > 255:
+        return False
+
+    columns = [
+        [node.rowid for node in nodes],
+        [node.parentID or 0 for node in nodes],
+        [node.task.position or 0 for node in nodes],
+        [node.depth for node in nodes],
+        [0 if node.collapsed else len(node.children) for node in nodes],
+        [statusIndex[node.task.completionStatus] for node in nodes],
+        [(COLLAPSED if node.collapsed else 0) | (INDEXED if labelTable.get(node.label[:-1]) is node else 0)
+            for node in nodes]
+    ]
+    textBytes = text.encode('utf-8')
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, schemaVersion, changeCounter, len(nodes),
+        nodes.index(taskTree.mode), len(statuses), len(textBytes), BYTE_ORDER_MARK)
+
+    temporaryPath = path + ".tmp"
+    with open(temporaryPath, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        for (typecode, column) in zip(COLUMNS, columns):
+            array.array(typecode, column).tofile(f)
+        f.write(textBytes)
+    os.replace(temporaryPath, path)
+
+    return True
+
+def readSnapshot(path, taskTree, schemaVersion, changeCounter):
+    """
+    Fill the empty 'taskTree' from the snapshot file at 'path' if it was written for this schema
+    version and change counter. Return 'False', leaving the tree untouched, when the file is
+    missing, stale or unreadable
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER_SIZE:
+                return False
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                (magic, formatVersion, fileSchemaVersion, fileChangeCounter, count, modeIndex,
+                    statusCount, textSize, byteOrderMark) = HEADER.unpack_from(mm)
+
+                if (magic != MAGIC or formatVersion != FORMAT_VERSION or byteOrderMark != BYTE_ORDER_MARK
+                        or fileSchemaVersion != schemaVersion or fileChangeCounter != changeCounter
+                        or size != HEADER_SIZE + NODE_SIZE * count + textSize):
+                    return False
+
+                with memoryview(mm) as view:
+                    offset = HEADER_SIZE
+                    columns = list()
+                    for typecode in COLUMNS:
+                        end = offset + array.array(typecode).itemsize * count
+                        columns.append(view[offset:end].cast(typecode).tolist())
+                        offset = end
+                    texts = str(view[offset:offset + textSize], 'utf-8').split(SEPARATOR)
+
+    except (OSError, ValueError):
+        return False
+
+    (rowids, parentIDs, positions, depths, childCounts, statusIndexes, flags) = columns
+    statuses = texts[:statusCount]
+    descriptions = texts[statusCount:statusCount + count]
+    labels = texts[statusCount + count:]
+
+    if len(labels) != count:
+        return False
+
+    # The nodes hold no reference cycles, so the cyclic garbage collector would only rescan the 
+    # growing heap over and over while they are created
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        parentIDs[0] = None
+        tasks = list(map(TodoTask, descriptions, positions, [statuses[index] for index in statusIndexes]))
+        nodes = list(map(TreeNode, rowids, parentIDs, tasks, depths, [(flag & COLLAPSED) != 0 for flag in flags]))
+
+        # Each node's children follow on from those of the nodes before it
+        start = 1
+        for (node, label, childCount) in zip(nodes, labels, childCounts):
+            node.label = label
+            if childCount:
+                node.children = nodes[start:start + childCount]
+                start += childCount
+
+        taskTree.root = nodes[0]
+        taskTree.mode = nodes[modeIndex]
+        taskTree.nodeTable.update(zip(rowids, nodes))
+        taskTree.labelTable.update((label[:-1], node) for (node, label, flag) in zip(nodes, labels, flags)
+            if flag & INDEXED)
+    finally:
+        if collecting:
+            gc.enable()
+
+    return True
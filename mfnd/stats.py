@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+
+Module for in-process instrumentation: per-command latency, SQL statement, row and tree reload
+counts, kept in bounded histograms and shown by the todoshell 'stats' command
+
+"""
+
+import collections
+import math
+import time
+
+
+class Histogram:
+    """
+    Bounded histogram of non-negative values. Values are counted in log-spaced buckets,
+    SUBBUCKETS per power of two, so memory stays constant however many values are added while
+    percentiles are accurate to within about 20%
+    """
+
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'buckets')
+
+    SUBBUCKETS = 4
+
+    def __init__(self):
+
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+
+        # Bucket index -> count. Zero has a bucket of its own, keyed None
+        self.buckets = dict()
+
+    def add(self, value):
+        """
+        Count one value
+        """
+
+        self.count += 1
+        self.total += value
+        if self.minimum == None or value < self.minimum:
+            self.minimum = value
+        if self.maximum == None or value > self.maximum:
+            self.maximum = value
+
+        index = math.floor(math.log2(value) * self.SUBBUCKETS) if value > 0 else None
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def upperBound(self, index):
+        """
+        Return the upper bound of the values counted in a bucket
+        """
+
+        return 0 if index == None else 2 ** ((index + 1) / self.SUBBUCKETS)
+
+    def percentile(self, percent):
+        """
+        Return an estimate of the value below which 'percent' of the values fall, or None when empty
+        """
+
+        if self.count == 0:
+            return None
+
+        rank = percent / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets, key=lambda index: -math.inf if index == None else index):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(max(self.upperBound(index), self.minimum), self.maximum)
+
+        return self.maximum
+
+    def mean(self):
+        """
+        Return the mean of the values, or None when empty
+        """
+
+        return self.total / self.count if self.count else None
+
+    def toDict(self):
+        """
+        Return a summary of the histogram that can be serialized as JSON
+        """
+
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'min': self.minimum,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.maximum,
+            'buckets': [[self.upperBound(index), self.buckets[index]]
+                for index in sorted(self.buckets, key=lambda index: -math.inf if index == None else index)]
+        }
+
+class CommandStats:
+    """
+    Per-command measurements. Each measured command adds its wall time and, for every probe, the
+    increase of the probe's counter while it ran to histograms kept per command name. The most
+    recent samples are also kept as they are, for offline analysis
+    """
+
+    def __init__(self, recentSamples=1000):
+        """
+        Initialize empty statistics, keeping at most 'recentSamples' raw samples
+        """
+
+        # Names of the measurements, and functions returning counters that only go up
+        self.metrics = ['ms']
+        self.counters = list()
+
+        # Command name -> one Histogram per metric, in the order the commands were first measured
+        self.histograms = dict()
+
+        # (command name, time it ran, value of each metric) of the latest commands
+        self.recent = collections.deque(maxlen=recentSamples)
+
+    def addProbe(self, name, counter):
+        """
+        Measure the increase of 'counter()' across each command as the metric 'name'. Probes are
+        added before anything is measured
+        """
+
+        self.metrics.append(name)
+        self.counters.append(counter)
+
+    def reset(self):
+        """
+        Forget every measurement taken so far
+        """
+
+        self.histograms.clear()
+        self.recent.clear()
+
+    def measure(self, name):
+        """
+        Return a context manager measuring the enclosed code as one run of the command 'name'
+        """
+
+        return Measurement(self, name)
+
+    def add(self, name, values):
+        """
+        Add one run of the command 'name', with a value for each metric
+        """
+
+        histograms = self.histograms.get(name)
+        if histograms == None:
+            histograms = [Histogram() for metric in self.metrics]
+            self.histograms[name] = histograms
+
+        for (histogram, value) in zip(histograms, values):
+            histogram.add(value)
+
+        self.recent.append((name, time.time(), values))
+
+    def report(self):
+        """
+        Return the lines of a table of the statistics of every command measured
+        """
+
+        width = max([len("command")] + [len(name) for name in self.histograms])
+        lines = ["%-*s %6s %9s %9s %9s %9s" % (width, "command", "count", "p50 ms", "p90 ms", "p99 ms", "max ms")
+            + "".join(" %11s" % ("mean " + metric) for metric in self.metrics[1:])]
+
+        for (name, histograms) in self.histograms.items():
+            timing = histograms[0]
+            line = "%-*s %6d %9.2f %9.2f %9.2f %9.2f" % (width, name, timing.count, timing.percentile(50),
+                timing.percentile(90), timing.percentile(99), timing.maximum)
+            for histogram in histograms[1:]:
+                line += " %11.1f" % histogram.mean()
+            lines.append(line)
+
+        if not self.histograms:
+            lines.append("(no commands measured yet)")
+
+        return lines
+
+    def dumpJson(self, out):
+        """
+        Write the statistics to the file object 'out' as JSON lines: one 'histogram' record per
+        command and metric, then one 'sample' record per recent sample, oldest first
+        """
+
+        import json
+
+        for (name, histograms) in self.histograms.items():
+            for (metric, histogram) in zip(self.metrics, histograms):
+                record = {'type': 'histogram', 'command': name, 'metric': metric}
+                record.update(histogram.toDict())
+                out.write(json.dumps(record) + "\n")
+
+        for (name, runTime, values) in self.recent:
+            record = {'type': 'sample', 'command': name, 'time': runTime}
+            record.update(zip(self.metrics, values))
+            out.write(json.dumps(record) + "\n")
+
+class Measurement:
+    """
+    Context manager measuring one run of a command into CommandStats
+    """
+
+    __slots__ = ('stats', 'name', 'before', 'start')
+
+    def __init__(self, stats, name):
+
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+
+        self.before = [counter() for counter in self.stats.counters]
+        self.start = time.perf_counter()
+
+    def __exit__(self, excType, excValue, traceback):
+
+        elapsed = 1e3 * (time.perf_counter() - self.start)
+        values = [elapsed] + [counter() - first for (counter, first) in zip(self.stats.counters, self.before)]
+        self.stats.add(self.name, values)
+
+        return False
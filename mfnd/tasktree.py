@@ -5,7 +5,8 @@ Module for the to-do list tree
 
 """
 
-import copy
+import collections
+import contextlib
 
 from todotask import TodoTask 
 
@@ -15,39 +16,141 @@ class TaskTree:
     Represents the to-do list and manages tree-like structure
     """
 
-    def __init__(self, database):
+    def __init__(self, database, cacheSize=10000):
         """
-        Initialize a to-do list task tree
+        Initialize a to-do list task tree. Sub-tasks of collapsed tasks are read from the database 
+        when first needed; at most about 'cacheSize' of them are kept in memory between commands
         """
 
-        # TODO: nodeTable should be indexed by label
-        # Any functions that take rowid should take label
-
         self.database = database
+        self.cacheSize = cacheSize
+        self.batchDepth = 0
+
+        # Number of times the whole tree has been read, for instrumentation (see stats.py)
+        self.reloads = 0
+
+        # Functions called after the tree is read again, which re-read any state kept in memory 
+        # alongside it (e.g. the undo/redo cursor, see cmdtoken.py)
+        self.reloadCallbacks = list()
+
         self.readDatabase()
 
     def readDatabase(self):
 
+        self.reloads += 1
+
+        # nodeTable is indexed by rowid, labelTable by label (without the trailing '.')
         self.nodeTable = dict()
+        self.labelTable = dict()
         self.root = None
         self.mode = None
+
+        # Collapsed nodes whose sub-tasks are loaded, least recently used first, with subtree sizes
+        self.loadedCollapsed = collections.OrderedDict()
+        self.loadedCount = 0
+
         self.database.initializeTaskTree(self)
 
+        for callback in self.reloadCallbacks:
+            callback()
+
+    def saveSnapshot(self):
+        """
+        Save the tree to the database's snapshot file, so the next session can start from it
+        """
+
+        self.database.saveSnapshot(self)
+
+    def refresh(self):
+        """
+        Reload the tree only if another connection has changed the database since it was read,
+        otherwise drop the least recently used collapsed subtrees beyond the cache size
+        """
+
+        # Inside a batch the write transaction keeps other connections out, and nodes the 
+        # batch has already looked up must stay in memory
+        if self.batchDepth > 0:
+            return
+
+        if self.database.hasExternalChanges():
+            self.readDatabase()
+            return
+
+        while self.loadedCount > self.cacheSize and self.loadedCollapsed:
+            (node, size) = self.loadedCollapsed.popitem(last=False)[1]
+            self.loadedCount -= size
+            if self.nodeTable.get(node.rowid) is node and node.collapsed and node.loaded:
+                self.__unloadSubtree(node)
+
+    def __ensureLoaded(self, node):
+        """
+        Make sure the sub-tasks of a collapsed node are in memory, and mark it recently used
+        """
+
+        if not node.collapsed:
+            return
+
+        if node.loaded:
+            if node.rowid in self.loadedCollapsed:
+                self.loadedCollapsed.move_to_end(node.rowid)
+            return
+
+        self.database.initializeSubtree(self, node.rowid)
+
+        # The query returns every descendant, including those of collapsed descendants
+        size = 0
+        stack = [node]
+        while stack:
+            subNode = stack.pop()
+            subNode.loaded = True
+            size += len(subNode.children)
+            stack.extend(subNode.children)
+
+        self.__cacheSubtree(node, size)
+
+    def __cacheSubtree(self, node, size):
+        """
+        Track the loaded sub-tasks of a collapsed node so they can be dropped when unused
+        """
+
+        old = self.loadedCollapsed.pop(node.rowid, None)
+        if old != None:
+            self.loadedCount -= old[1]
+
+        self.loadedCollapsed[node.rowid] = (node, size)
+        self.loadedCount += size
+
+    def __unloadSubtree(self, node):
+        """
+        Drop the sub-tasks of a collapsed node from memory; they are read again when needed
+        """
+
+        for childNode in node.children:
+            self.__forgetSubtree(childNode)
+
+        node.children = TreeNode.NO_CHILDREN
+        node.loaded = False
+
     def insertTask(self, task, parentLabel=None):
+        """
+        Insert a new task into the database and the tree. Return its label
+        """
+
+        self.refresh()
 
         if parentLabel == None:
             parentID = self.mode.rowid
         else:
             parentID = self.lookupRowid(parentLabel)
+            self.__ensureLoaded(self.nodeTable[parentID])
 
         rowid = self.database.insertTask(task, parentID)
-        self.readDatabase()
-        label = self.lookupLabel(rowid)
 
         node = TreeNode(rowid, parentID, task)
-        self.insertNode(node)
+        self.nodeTable[rowid] = node
+        self.nodeTable[parentID].insertChild(node, task.position, self.labelTable)
 
-        return label
+        return node.label
 
     def insertNode(self, node):
         """
@@ -64,49 +167,291 @@ class TaskTree:
         self.nodeTable[node.rowid] = node
         
         if node.parentID in self.nodeTable:
-            self.nodeTable[node.parentID].addChild(node)
+            self.nodeTable[node.parentID].addChild(node, self.labelTable)
             node.depth = self.nodeTable[node.parentID].depth + 1
 
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager applying every change made to the tree inside it in one transaction. If 
+        one of them fails, none are kept and the tree (and with it the reloadCallbacks' state) is 
+        read again from the database
+        """
+
+        self.database.begin()
+        if self.batchDepth == 0:
+            # The write transaction keeps other connections out from here on, so what another 
+            # connection committed before it is read now and stays current for the whole batch
+            try:
+                self.refresh()
+            except:
+                self.database.rollback()
+                raise
+
+        self.batchDepth += 1
+        try:
+            yield
+        except:
+            self.batchDepth -= 1
+            self.database.rollback()
+            self.readDatabase()
+            raise
+        self.batchDepth -= 1
+        self.database.commit()
+
+    def expandLabels(self, patterns):
+        """
+        Return the labels matched by 'patterns', in the given order without repeats. A pattern is 
+        a label ('2.a'), a range of siblings ('1-40', '2.a-2.f' or '2.a-f') or the sub-tasks of a 
+        task ('3.*'). Raise KeyError for a pattern that matches no task
+        """
+
+        self.refresh()
+
+        rowids = list()
+
+        for pattern in patterns:
+            if pattern.endswith(".*"):
+                rowid = self.lookupRowid(pattern[:-2])
+                if rowid == -1:
+                    raise KeyError(pattern)
+                node = self.nodeTable[rowid]
+                self.__ensureLoaded(node)
+                rowids.extend(childNode.rowid for childNode in node.children)
+
+            elif "-" in pattern:
+                (first, last) = pattern.split("-", 1)
+                first = first.rstrip(".")
+                last = last.rstrip(".")
+                if "." in first and "." not in last:
+                    last = first.rsplit(".", 1)[0] + "." + last
+
+                firstID = self.lookupRowid(first)
+                lastID = self.lookupRowid(last)
+                if firstID == -1 or lastID == -1:
+                    raise KeyError(pattern)
+
+                firstNode = self.nodeTable[firstID]
+                lastNode = self.nodeTable[lastID]
+                if firstNode.parentID != lastNode.parentID or firstNode.task.position > lastNode.task.position:
+                    raise KeyError(pattern)
+
+                siblings = self.nodeTable[firstNode.parentID].children
+                rowids.extend(node.rowid for node in siblings[firstNode.task.position - 1:lastNode.task.position])
+
+            else:
+                rowid = self.lookupRowid(pattern)
+                if rowid == -1:
+                    raise KeyError(pattern)
+                rowids.append(rowid)
+
+        return [self.nodeTable[rowid].label for rowid in dict.fromkeys(rowids)]
+
     def deleteTask(self, label):
         """
-        Delete a task from the tree
+        Delete a task and its sub-tasks from the tree
         """
 
-        rowid = self.lookupRowid(label)
-        node = self.nodeTable[rowid]
-        parentLabel = self.nodeTable[node.parentID].label
-        trace = NodeTrace(node, parentLabel)
+        self.deleteTasks([label])
 
-        self.database.deleteTask(rowid)
+    def deleteTasks(self, labels):
+        """
+        Delete several tasks from the tree in one transaction; a task inside another deleted task
+        goes with it
+        """
 
-        return trace
+        self.refresh()
 
-    def insertTrace(self, nodeTrace):
+        nodes = [self.nodeTable[self.lookupRowid(label)] for label in labels]
+        selected = set(node.rowid for node in nodes)
+        nodes = [node for node in nodes if not self.__hasAncestorIn(node, selected)]
 
-        labelUnset = True
+        self.database.deleteTasks([node.rowid for node in nodes])
 
-        for n in nodeTrace.list:
-            node = n[0]
-            label = n[1]
-            
-            currLabel = self.insertTask(node.task, label)
+        # Sub-tasks of collapsed tasks that were never loaded are not in memory to forget
+        for node in nodes:
+            parent = self.nodeTable[node.parentID]
+            parent.removeChild(node, self.labelTable)
+            self.__forgetSubtree(node)
 
-            if labelUnset:
-                rootLabel = currLabel
+    def __hasAncestorIn(self, node, rowids):
+        """
+        Return True if one of the node's ancestors has its rowid in 'rowids'
+        """
+
+        parentID = node.parentID
+        while parentID in self.nodeTable:
+            if parentID in rowids:
+                return True
+            parentID = self.nodeTable[parentID].parentID
+
+        return False
+
+    def __forgetSubtree(self, node):
+        """
+        Drop a node and its descendants from nodeTable and labelTable
+        """
+
+        self.__forgetNode(node)
+        for childNode in node.children:
+            self.__forgetSubtree(childNode)
 
-        return rootLabel
+    def __forgetNode(self, node):
+        """
+        Drop a single node from nodeTable and labelTable
+        """
+
+        del self.nodeTable[node.rowid]
+        cached = self.loadedCollapsed.pop(node.rowid, None)
+        if cached != None:
+            self.loadedCount -= cached[1]
+        key = node.label[:-1]
+        if self.labelTable.get(key) is node:
+            del self.labelTable[key]
+
+    def __invalidate(self, node):
+        """
+        Discard the cached output line of a node whose task has changed. Changes of label or 
+        depth discard it as they are made
+        """
+
+        node.rendered = None
 
     def lookupRowid(self, label):
         """
-        Lookup a task's database rowid based on its label in the TaskTree
+        Lookup a task's database rowid based on its label in the TaskTree. Return -1 if there is none
         """
 
-        root = self.root
-        rowid = root.lookupRowid(label)
-        if rowid != -1:
-            return rowid
+        if label.endswith("."):
+            label = label[:-1]
+
+        node = self.labelTable.get(label)
+        if node == None:
+            node = self.__loadLabel(label)
+            if node == None:
+                return -1
 
-        return -1
+        return node.rowid
+
+    def __loadLabel(self, label):
+        """
+        Find the task at 'label' inside a collapsed task whose sub-tasks are not loaded yet.
+        Return its node, or None if there is no such task
+        """
+
+        # The nearest labelled ancestor decides whether the label can exist at all
+        parts = label.split(".")
+        for end in range(len(parts) - 1, 0, -1):
+            ancestor = self.labelTable.get(".".join(parts[:end]))
+            if ancestor != None:
+                if not ancestor.collapsed or ancestor.loaded:
+                    return None
+                self.__ensureLoaded(ancestor)
+                return self.labelTable.get(label)
+
+        return None
+
+    def nodeFor(self, rowid):
+        """
+        Return the node of the task 'rowid', first loading the collapsed tasks it is hidden in.
+        Raise KeyError if there is no such task
+        """
+
+        if rowid not in self.nodeTable:
+            for ancestorID in self.database.ancestorIDs(rowid):
+                if ancestorID in self.nodeTable:
+                    self.__ensureLoaded(self.nodeTable[ancestorID])
+
+        return self.nodeTable[rowid]
+
+    def applyChanges(self, changes, undo=False):
+        """
+        Apply a command's row-level change set (see TodoDatabase.stopRecording) in one 
+        transaction, forwards to redo the command or backwards to undo it. In memory only the 
+        changed tasks are updated, and spliced out of and into the sub-task lists they leave or join
+        """
+
+        self.refresh()
+
+        # First and last state of each changed row, in the order the change set is applied
+        states = dict()
+        for (rowid, before, after) in (reversed(changes) if undo else changes):
+            (old, new) = (after, before) if undo else (before, after)
+            state = states.setdefault(rowid, [old, new])
+            state[1] = new
+
+        with self.batch():
+            # A task that changes parent must be in memory to be moved, wherever it ends up
+            for (rowid, (old, new)) in states.items():
+                if old != None and new != None and old[0] != new[0]:
+                    self.nodeFor(rowid)
+
+            self.database.applyChanges(changes, undo)
+
+            # Positions left in each sub-task list and (node, sort key) pairs joining it
+            leaving = collections.defaultdict(list)
+            joining = collections.defaultdict(list)
+            created = list()
+
+            for (rowid, (old, new)) in states.items():
+                node = self.nodeTable.get(rowid)
+                if node == None:
+                    if new != None:
+                        created.append((new[4], rowid, new))
+                elif new == None:
+                    leaving[node.parentID].append(node.task.position)
+                    self.__forgetNode(node)
+                else:
+                    node.task.description = new[1]
+                    node.task.completionStatus = new[3]
+                    self.__invalidate(node)
+                    if old == None or old[0] != new[0] or old[2] != new[2]:
+                        leaving[node.parentID].append(node.task.position)
+                        joining[new[0]].append((node, new[2]))
+
+            # Parents before children; sub-tasks of tasks that are not loaded are read when needed
+            for (depth, rowid, new) in sorted(created, key=lambda item: item[0]):
+                parent = self.nodeTable.get(new[0])
+                if parent != None and parent.loaded:
+                    task = TodoTask(new[1], None, new[3])
+                    node = TreeNode(rowid, parent.rowid, task, depth, new[5] != 0)
+                    self.nodeTable[rowid] = node
+                    joining[parent.rowid].append((node, new[2]))
+
+            # Every changed sub-task list is in place before any label is recomputed, and 
+            # shallower lists are relabelled first so each label is computed only from final ones
+            ranges = list()
+            for parentID in set(leaving) | set(joining):
+                parent = self.nodeTable.get(parentID)
+                if parent == None or not parent.loaded:
+                    continue
+
+                inserted = [(self.database.rankOf(parentID, key), node) for (node, key) in joining.get(parentID, ())]
+                ranges.append((parent, parent.spliceChildren(leaving.get(parentID, ()), inserted)))
+
+            for (parent, (start, stop)) in sorted(ranges, key=lambda item: self.__depthOf(item[0])):
+                parent.relabelChildren(start, stop, self.labelTable)
+
+            # Moved tasks that now sit in a collapsed task's unloaded sub-tasks leave memory
+            for (parentID, pairs) in joining.items():
+                parent = self.nodeTable.get(parentID)
+                if parent == None or not parent.loaded:
+                    for (node, key) in pairs:
+                        if self.nodeTable.get(node.rowid) is node:
+                            self.__forgetSubtree(node)
+
+    def __depthOf(self, node):
+        """
+        Count the ancestors of a node in memory, which may differ from its stored depth while 
+        sub-task lists are being rearranged
+        """
+
+        depth = 0
+        while node.parentID in self.nodeTable:
+            node = self.nodeTable[node.parentID]
+            depth += 1
+
+        return depth
 
     def lookupLabel(self, rowid):
         """
@@ -115,87 +460,232 @@ class TaskTree:
 
         return self.nodeTable[rowid].label
 
+    def setDoneTasks(self, labels):
+        """
+        Mark the tasks at labels as done in one transaction. Return the labels that were not done
+        """
+
+        return self.__setStatuses(labels, TodoTask.TASK_DONE)
+
+    def __setStatuses(self, labels, completionStatus):
+        """
+        Set the completion status of the tasks at labels. Return the labels of those it changed
+        """
+
+        self.refresh()
+
+        nodes = [self.nodeTable[self.lookupRowid(label)] for label in labels]
+        nodes = [node for node in nodes if node.task.completionStatus != completionStatus]
+
+        self.database.updateCompletionStatuses([node.rowid for node in nodes], completionStatus)
+
+        for node in nodes:
+            node.task.completionStatus = completionStatus
+            self.__invalidate(node)
+
+        return [node.label for node in nodes]
+
     def setDone(self, label):
         """
         Mark the task at label as done
         """
 
+        self.refresh()
+
         rowid = self.lookupRowid(label)
         self.database.updateCompletionStatus(rowid, TodoTask.TASK_DONE)
+        self.nodeTable[rowid].task.completionStatus = TodoTask.TASK_DONE
+        self.__invalidate(self.nodeTable[rowid])
 
-    def setUndone(self, label):
+    def moveTaskUp(self, label):
         """
-        Mark the task at rowid as undone
+        Move a task up one position. Return its (newLabel, oldPosition)
         """
 
+        self.refresh()
+
         rowid = self.lookupRowid(label)
-        self.database.updateCompletionStatus(rowid, TodoTask.TASK_UNDONE)
+        position = self.nodeTable[rowid].task.position
 
-    def moveTaskUp(self, label):
+        return self.moveTask(label, position - 1)
+
+    def moveTaskDown(self, label):
         """
-        Move a task up one position
+        Move a task down one position. Return its (newLabel, oldPosition)
         """
 
+        self.refresh()
+
         rowid = self.lookupRowid(label)
-        trace = self.deleteTask(rowid)
-        root = trace.list[0][0]
+        position = self.nodeTable[rowid].task.position
 
-        if root.task.position > 1:
-            root.task.position -= 1
+        return self.moveTask(label, position + 1)
 
-        self.readDatabase()
-        newLabel = self.insertTrace(trace)
+    def moveTaskBottom(self, label):
+        """
+        Move a task below all of its siblings. Return its (newLabel, oldPosition)
+        """
 
-        return newLabel
+        self.refresh()
 
-    def moveTaskDown(self, label):
+        rowid = self.lookupRowid(label)
+        parent = self.nodeTable[self.nodeTable[rowid].parentID]
+
+        return self.moveTask(label, len(parent.children))
+
+    def moveTask(self, label, position):
         """
-        Move a task down one position
+        Move a task to a new position among its siblings. Return its (newLabel, oldPosition)
         """
 
+        self.refresh()
+
         rowid = self.lookupRowid(label)
-        trace = self.deleteTask(rowid)
-        root = trace.list[0][0]
+        (oldPosition, newPosition) = self.database.moveTask(rowid, position)
+
+        node = self.nodeTable[rowid]
+        if newPosition != oldPosition:
+            parent = self.nodeTable[node.parentID]
+            parent.moveChild(node, newPosition, self.labelTable)
 
-        root.task.position += 1
-        # TODO: Should check if at bottom already
+        return (node.label, oldPosition)
 
-        self.readDatabase()
-        newLabel = self.insertTrace(trace)
+    def moveTaskUnder(self, label, parentLabel, position=None):
+        """
+        Move a task and its sub-tasks under the task at 'parentLabel' (the top level when None).
+        Return its (newLabel, oldParentLabel, oldPosition)
+        """
 
-        return newLabel
+        self.refresh()
 
-    def moveTask(self, label, position):
+        rowid = self.lookupRowid(label)
+        if parentLabel == None:
+            parentID = self.mode.rowid
+        else:
+            parentID = self.lookupRowid(parentLabel)
+            if parentID in self.nodeTable:
+                self.__ensureLoaded(self.nodeTable[parentID])
+
+        (oldParentID, oldPosition, newPosition) = self.database.reparentTask(rowid, parentID, position)
+
+        node = self.nodeTable[rowid]
+        self.nodeTable[oldParentID].removeChild(node, self.labelTable)
+        self.nodeTable[parentID].insertChild(node, newPosition, self.labelTable)
+
+        if oldParentID == self.mode.rowid:
+            oldParentLabel = None
+        else:
+            oldParentLabel = self.lookupLabel(oldParentID)
+
+        return (node.label, oldParentLabel, oldPosition)
+
+    def moveTasksUnder(self, labels, parentLabel):
         """
-        Move a task to a new position
+        Move several tasks, in list order, below the last sub-task of the task at 'parentLabel' (the 
+        top level when None) in one transaction; a task inside another moved task moves with it. 
+        Return the (rowid, oldParentID, oldPosition) of each move; undoing them in reverse order 
+        restores the list
         """
 
-        print("label = " + label)
-        print("position = " + str(position))
+        self.refresh()
 
+        nodes = [self.nodeTable[self.lookupRowid(label)] for label in labels]
+        selected = set(node.rowid for node in nodes)
+        rowids = [node.rowid for node in nodes if not self.__hasAncestorIn(node, selected)]
+        if parentLabel == None:
+            parentID = None
+        else:
+            parentID = self.lookupRowid(parentLabel)
+
+        # Labels shift as tasks move, so each move looks them up again from the rowids
+        moves = list()
+        with self.batch():
+            for rowid in rowids:
+                if parentID == None:
+                    parentLabel = None
+                else:
+                    parentLabel = self.lookupLabel(parentID)
+                oldParentID = self.nodeTable[rowid].parentID
+                (newLabel, oldParentLabel, oldPosition) = self.moveTaskUnder(self.lookupLabel(rowid), parentLabel)
+                moves.append((rowid, oldParentID, oldPosition))
+
+        return moves
+
+    def collapseTask(self, label):
+        """
+        Hide the sub-tasks of the task at 'label' when the list is shown
+        """
+
+        self.refresh()
 
         rowid = self.lookupRowid(label)
-        trace = self.deleteTask(rowid)
-        root = trace.list[0][0]
+        node = self.nodeTable[rowid]
+        if node.collapsed:
+            return
 
-        oldPosition = root.task.position
-        root.task.position = position
+        self.database.setCollapsed(rowid, True)
+        node.collapsed = True
+        self.__invalidate(node)
 
-        self.readDatabase()
-        newLabel = self.insertTrace(trace)
-        self.readDatabase()
+        size = 0
+        stack = list(node.children)
+        while stack:
+            subNode = stack.pop()
+            size += 1
+            stack.extend(subNode.children)
+
+        self.__cacheSubtree(node, size)
+
+    def expandTask(self, label):
+        """
+        Show the sub-tasks of the task at 'label' again, reading them from the database if needed
+        """
+
+        self.refresh()
+
+        rowid = self.lookupRowid(label)
+        node = self.nodeTable[rowid]
+        if not node.collapsed:
+            return
+
+        self.__ensureLoaded(node)
+        self.database.setCollapsed(rowid, False)
+        node.collapsed = False
+        self.__invalidate(node)
+
+        # Visible sub-tasks always stay in memory
+        cached = self.loadedCollapsed.pop(rowid, None)
+        if cached != None:
+            self.loadedCount -= cached[1]
 
-        print("newLabel = " + newLabel)
-        print("oldPosition = " + str(oldPosition))
+    def iterLines(self, label=None, depth=None):
+        """
+        Yield the output lines of the to-do list one at a time, or only those of the task at 'label' 
+        and its sub-tasks. 'depth' limits how many levels below the top-level tasks (or below the 
+        task at 'label') are included. Raise KeyError if there is no task at 'label'
+        """
+
+        self.refresh()
+
+        if label == None:
+            node = self.mode
+            # The top-level tasks are themselves one level below the [default] task
+            if depth != None:
+                depth += 1
+        else:
+            rowid = self.lookupRowid(label)
+            if rowid == -1:
+                raise KeyError(label)
+            node = self.nodeTable[rowid]
 
-        return (newLabel, oldPosition)
+        return node.iterLines(depth)
 
     def __str__(self):
         """
         Return a human readable str representation of this tree
         """
 
-        self.readDatabase()
+        self.refresh()
 
         if self.root == None:
             return "[Empty Task Tree]"
@@ -207,7 +697,13 @@ class TreeNode:
     Represents a single task in the to-do tree
     """
 
-    def __init__(self, rowid, parentID, task, depth=0):
+    # Trees can hold hundreds of thousands of nodes, so avoid a per-node __dict__
+    __slots__ = ('label', 'rowid', 'parentID', 'depth', 'task', 'children', 'rendered', 'collapsed', 'loaded')
+
+    # Shared by every leaf until it gains its first child
+    NO_CHILDREN = ()
+
+    def __init__(self, rowid, parentID, task, depth=0, collapsed=False):
         """
         Initialize a to-do tree node
         """
@@ -218,56 +714,219 @@ class TreeNode:
         self.depth = depth
 
         self.task = task
-        self.children = []
+        self.children = TreeNode.NO_CHILDREN
 
-    def addChild(self, childNode):
+        # Cached output line of this task, None when it must be formatted again
+        self.rendered = None
+
+        # A collapsed node hides its sub-tasks, which are only in 'children' once loaded
+        self.collapsed = collapsed
+        self.loaded = not collapsed
+
+    def addChild(self, childNode, labelTable=None):
         """
         Add a child node to this node
         """
 
+        if not self.children:
+            self.children = list()
+
         self.children.append(childNode)
+        self.__labelChild(childNode, labelTable)
+
+    def insertChild(self, childNode, position=None, labelTable=None):
+        """
+        Insert a child node at 1-based 'position' (after the last child when None), renumbering 
+        and relabelling the children that follow it
+        """
+
+        if not self.children:
+            self.children = list()
+
+        if position == None or position > len(self.children):
+            position = len(self.children) + 1
+
+        childNode.parentID = self.rowid
+        self.children.insert(position - 1, childNode)
+        self.__renumber(position - 1, labelTable)
+
+    def removeChild(self, childNode, labelTable=None):
+        """
+        Remove a child node, renumbering and relabelling the children that followed it
+        """
+
+        index = childNode.task.position - 1
+        del self.children[index]
+        self.__renumber(index, labelTable)
+
+    def moveChild(self, childNode, position, labelTable=None):
+        """
+        Move a child node to 1-based 'position', renumbering and relabelling only the children 
+        between its old and new places
+        """
+
+        oldIndex = childNode.task.position - 1
+        newIndex = min(max(position, 1), len(self.children)) - 1
+
+        del self.children[oldIndex]
+        self.children.insert(newIndex, childNode)
+        self.__renumber(min(oldIndex, newIndex), labelTable, max(oldIndex, newIndex) + 1)
+
+    def spliceChildren(self, removed, inserted):
+        """
+        Remove the child nodes at the 1-based positions in 'removed', then insert each (position, node) of 'inserted' at its 
+        1-based position, lowest first. Positions are renumbered but labels are left alone, so 
+        several lists can change before any is relabelled. Return the (start, stop) index range 
+        of the children to pass to relabelChildren()
+        """
+
+        oldCount = len(self.children)
+        children = self.children if self.children else list()
+
+        changed = sorted((position - 1 for position in removed), reverse=True)
+        for index in changed:
+            del children[index]
+
+        for (position, childNode) in sorted(inserted, key=lambda item: item[0]):
+            childNode.parentID = self.rowid
+            children.insert(position - 1, childNode)
+            changed.append(position - 1)
+
+        if not changed:
+            return (0, 0)
+
+        self.children = children if children else TreeNode.NO_CHILDREN
+
+        start = min(changed)
+        stop = len(children) if len(children) != oldCount else max(changed) + 1
+        for index in range(start, stop):
+            children[index].task.position = index + 1
+
+        return (start, stop)
+
+    def relabelChildren(self, start, stop, labelTable=None):
+        """
+        Relabel the children from index 'start' up to 'stop', and their descendants
+        """
+
+        self.__renumber(start, labelTable, stop)
+
+    def relabel(self, labelTable=None):
+        """
+        Recompute the depth and label of every descendant of this node
+        """
+
+        for childNode in self.children:
+            self.__labelChild(childNode, labelTable)
+            childNode.relabel(labelTable)
+
+    def __renumber(self, start, labelTable, stop=None):
+        """
+        Reassign positions and labels of the children from index 'start' up to 'stop' (the end 
+        when None)
+        """
+
+        if stop == None:
+            stop = len(self.children)
+
+        for index in range(start, stop):
+            childNode = self.children[index]
+            childNode.task.position = index + 1
+            self.__labelChild(childNode, labelTable)
+            childNode.relabel(labelTable)
+
+    def __labelChild(self, childNode, labelTable):
+        """
+        Set a child node's depth and its label from this node's label and the child's position
+        """
+
+        if childNode.depth != self.depth + 1:
+            childNode.depth = self.depth + 1
+            childNode.rendered = None
 
         if self.depth > 0:
             if self.depth == 2:
-                childNode.label = self.label + TreeNode.__charPos(childNode.task.position) + "."
+                childNode.setLabel(self.label + TreeNode.__charPos(childNode.task.position) + ".", labelTable)
             else:
-                childNode.label = self.label + str(childNode.task.position) + "."
+                childNode.setLabel(self.label + str(childNode.task.position) + ".", labelTable)
+
+    def setLabel(self, label, labelTable=None):
+        """
+        Change this node's label, keeping the tree's label index 'labelTable' (if any) up to date
+        """
+
+        if label == self.label:
+            return
+
+        if labelTable != None:
+            oldKey = self.label[:-1]
+            if labelTable.get(oldKey) is self:
+                del labelTable[oldKey]
+            labelTable[label[:-1]] = self
+
+        self.label = label
+        self.rendered = None
 
     def __str__(self):
         return "[-- TreeNode --]"
 
-    def lookupRowid(self, label):
+    def toString(self):
         """
-        Lookup a task's database rowid based on its label in the TaskTree
+        Return a human readable str representation of this node and its sub-tasks, joined once 
+        from the lines cached on each node. Only the lines of changed tasks are formatted again
         """
 
-        if self.label[:-1] == label or self.label == label:
-            return self.rowid
+        return "".join(self.iterLines())
 
-        for childNode in self.children:
-            rowid = childNode.lookupRowid(label)
-            if rowid != -1:
-                return rowid
+    def iterLines(self, depth=None):
+        """
+        Lazily yield the output lines of this node and of its descendants down to 'depth' levels 
+        below it (all of them when None). Nothing is rendered ahead of the consumer
+        """
+
+        level = self.depth - 1
+        if level > 0:
+            yield self.line()
+
+        if self.collapsed or (depth != None and depth < 1):
+            return
+
+        # Walk depth-first with a stack of child iterators rather than nested generators
+        maxLevel = None if depth == None else level + depth
+        stack = [iter(self.children)]
+        while stack:
+            node = next(stack[-1], None)
+            if node == None:
+                stack.pop()
+                continue
+
+            level = node.depth - 1
+            yield node.line()
 
-        return -1
+            if node.children and not node.collapsed and (maxLevel == None or level < maxLevel):
+                stack.append(iter(node.children))
 
-    def toString(self, level=0):
+    def line(self):
         """
-        Return a human readable str representation of this node
+        Return the output line for this task, formatting it only if it has changed since last time
         """
 
-        outputStr = "  " * level
+        if self.rendered == None:
+            self.rendered = self.renderLine(self.depth - 1)
 
-        if level > 0:
-            if self.task.completionStatus == TodoTask.TASK_DONE:
-                outputStr += "--- " + self.task.description + " ---\n"
-            else:
-                outputStr += " " + self.label + " " + self.task.description + "\n"
+        return self.rendered
+
+    def renderLine(self, level):
+        """
+        Return the single output line for this task, indented for 'level'
+        """
 
-        for node in self.children:
-            outputStr += node.toString(level + 1)
+        marker = " [+]" if self.collapsed else ""
 
-        return outputStr
+        if self.task.completionStatus == TodoTask.TASK_DONE:
+            return "  " * level + "--- " + self.task.description + " ---" + marker + "\n"
+        else:
+            return "  " * level + " " + self.label + " " + self.task.description + marker + "\n"
 
     def __charPos(position):
         num = position - 1
@@ -281,23 +940,3 @@ class TreeNode:
         outputStr = TreeNode.__charPos(num) + outputStr
 
         return outputStr
-
-class NodeTrace:
-
-    def __init__(self, root, parentLabel):
-
-        self.root = root
-        self.list = list()
-        self.add(root, parentLabel)
-
-    def add(self, node, label):
-
-        copyNode = copy.deepcopy(node)
-        if label == "":
-            label = None   
-        self.list.append( (copyNode, label) )
-
-        label = node.label
-        for childNode in node.children:
-            self.add(childNode, label)
-
@@ -6,13 +6,17 @@ Module defining a custom command shell for mfnd
 """
 
 import cmd
-import datetime
+import itertools
+import re
 import sys
 import sqlite3
+import time
 
 import cmdtoken
+from stats import CommandStats
 from todotask import TodoTask
 from tasktree import TaskTree
+from database import TodoDatabase
 
 
 def printHelp():
@@ -27,16 +31,34 @@ def printHelp():
     print("                       Requires 4 digits in 24-hour clock mode (default 0400)")
     print("    undo               Undo previous command")
     print("    redo               Redo previous undone command")
+    print("    stats              Show the time, SQL statements and rows changed per command")
+    print("    stats --json [<F>] Write them as JSON lines to stdout or appended to file <F>")
+    print("    stats --sql on|off Count SQL statements (off by default, as it slows them down)")
+    print("    stats --reset      Forget the statistics")
     print()
     print("    todo <description>   Add a new task with <description>")
     print("    todosub <P> <description>  Add a sub-task under the task at position <P>")
-    print("    done <P>           Mark the task at <P> as complete")
-    print("    remove <P>         Delete the task at <P>")
+    print("    done <P> ...       Mark the tasks at <P> ... as complete")
+    print("    remove <P> ...     Delete the tasks at <P> ...")
     print()
     print("    move <P> up        Move task at <P> up one position")
     print("    move <P> down      Move task at <P> down one position")
     print("    move <P> top       Move task at <P> to top position")
     print("    move <P> bottom    Move task at <P> to bottom position")
+    print("    move <P> under <Q> Move task at <P> and its sub-tasks under the task at <Q>")
+    print("    move <P> ... under <Q>")
+    print("                       Move several tasks under the task at <Q>")
+    print()
+    print("    Where several tasks are allowed, <P> can also be a range of tasks (1-40, 2.a-2.f)")
+    print("    or all sub-tasks of a task (3.*)")
+    print()
+    print("    collapse <P>       Hide the sub-tasks of the task at <P>")
+    print("    expand <P>         Show the sub-tasks of the task at <P> again")
+    print()
+    print("    show               Show the whole list after each command")
+    print("    show [<P>] [<A>-<B>] [--depth <N>]")
+    print("                       Only show the task at <P> and its sub-tasks, lines <A> to <B>")
+    print("                       and/or <N> levels of sub-tasks")
 
 
 class TodoShell(cmd.Cmd):
@@ -47,6 +69,12 @@ class TodoShell(cmd.Cmd):
     prompt = '> '
     file = None
 
+    # Lines are written to stdout in batches of this size when streaming the list
+    CHUNK_LINES = 256
+
+    # Script commands are committed in transactions of this many commands
+    SCRIPT_GROUP_SIZE = 1000
+
     def __init__(self, taskTree):
         """
         Initialize a shell for todo-list commands
@@ -60,6 +88,23 @@ class TodoShell(cmd.Cmd):
 
         self.taskTree = taskTree
         cmdtoken.CommandStack.setTaskTree(taskTree)
+        self.__loadHistory()
+
+        # Every command is measured, and command tokens, undo and redo on their own as well
+        self.stats = CommandStats()
+        self.stats.addProbe('statements', lambda: taskTree.database.statementCount)
+        self.stats.addProbe('rows', lambda: taskTree.database.rowsChanged)
+        self.stats.addProbe('reloads', lambda: taskTree.reloads)
+        cmdtoken.CommandStack.stats = self.stats
+
+        # Portion of the list shown after each command, set by 'show' (None shows everything)
+        self.view = None
+
+        # Line number of the script command being run, None when commands are typed in
+        self.scriptLine = None
+
+        # Number of warnings printed so far, i.e. of commands that could not be carried out
+        self.warnings = 0
 
     def cmdloop(self):
         """
@@ -75,6 +120,18 @@ class TodoShell(cmd.Cmd):
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    def onecmd(self, line):
+        """
+        Run one command line, measured under the name of its command
+        """
+
+        name = self.parseline(line)[0]
+        if not name or not hasattr(self, 'do_' + name):
+            return super().onecmd(line)
+
+        with self.stats.measure(name):
+            return super().onecmd(line)
+
     def emptyline(self):
         """
         Entering an empty command just provides a blank prompt
@@ -85,13 +142,25 @@ class TodoShell(cmd.Cmd):
         Print help screen and display a warning about the unusable command
         """
 
-        printHelp()
-        print()
+        if self.scriptLine == None:
+            printHelp()
+            print()
 
         if line != None:
-            print("!!! Warning unusable input: '" + line + "'")
+            self.__warn("unusable input: '" + line + "'")
+        else:
+            self.__warn("unusable input")
+
+    def __warn(self, message):
+        """
+        Print a warning, with the line number when it comes from a script
+        """
+
+        self.warnings += 1
+        if self.scriptLine == None:
+            print("!!! Warning " + message)
         else:
-            print("!!! Warning unusable input")
+            print("!!! Warning line " + str(self.scriptLine) + ": " + message)
 
     def do_exit(self, arg):
         """
@@ -129,6 +198,10 @@ class TodoShell(cmd.Cmd):
         """
 
         tokens = arg.split()
+        if not tokens or self.taskTree.lookupRowid(tokens[0]) == -1:
+            self.default(self.lastcmd)
+            return
+
         parentLabel = tokens[0]
         description = str(" ".join(tokens[1:]))
 
@@ -140,22 +213,34 @@ class TodoShell(cmd.Cmd):
 
     def do_done(self, arg):
         """
-        Mark a task in the to-do list as done
+        Mark one or more tasks in the to-do list as done
         """
 
-        label = arg
-        command = cmdtoken.DoneCommand(label)
+        labels = self.__expandLabels(arg.split())
+        if labels == None:
+            return
+
+        if TodoShell.__isSingleLabel(arg):
+            command = cmdtoken.DoneCommand(labels[0])
+        else:
+            command = cmdtoken.BatchDoneCommand(labels)
         command.execute()   
 
         self.__printState()
 
     def do_remove(self, arg):
         """
-        Delete a task from the to-do list
+        Delete one or more tasks from the to-do list
         """
 
-        label = arg
-        command = cmdtoken.RemoveCommand(label)
+        labels = self.__expandLabels(arg.split())
+        if labels == None:
+            return
+
+        if TodoShell.__isSingleLabel(arg):
+            command = cmdtoken.RemoveCommand(labels[0])
+        else:
+            command = cmdtoken.BatchRemoveCommand(labels)
         command.execute()
 
         self.__printState()
@@ -165,7 +250,7 @@ class TodoShell(cmd.Cmd):
         Set the time at which the database will clear the to-do list
         """
 
-        self.database.configurePumpkinTime(arg)
+        self.taskTree.database.configurePumpkinTime(arg)
 
         self.__printState()
 
@@ -175,12 +260,34 @@ class TodoShell(cmd.Cmd):
         """
 
         tokens = arg.split()
-        if len(tokens) != 2:
+        if len(tokens) >= 3 and tokens[-2] == 'under':
+            labels = self.__expandLabels(tokens[:-2])
+            if labels == None:
+                return
+            if self.taskTree.lookupRowid(tokens[-1]) == -1:
+                self.default(self.lastcmd)
+                return
+
+            if len(tokens) == 3 and TodoShell.__isSingleLabel(tokens[0]):
+                command = cmdtoken.MoveUnderCommand(labels[0], tokens[-1])
+            else:
+                command = cmdtoken.BatchMoveUnderCommand(labels, tokens[-1])
+            try:
+                command.execute()
+            except TodoDatabase.TaskIndexException as err:
+                self.__warn(str(err))
+                return
+            self.__printState()
+            return
+        elif len(tokens) != 2:
             self.default(self.lastcmd)
             return
 
         label = tokens[0]
         direction = tokens[1]
+        if self.taskTree.lookupRowid(label) == -1:
+            self.default(self.lastcmd)
+            return
 
         if direction == 'up':
             command = cmdtoken.MoveUpCommand(label)
@@ -206,6 +313,93 @@ class TodoShell(cmd.Cmd):
 
         self.__printState()
 
+    def do_collapse(self, arg):
+        """
+        Hide the sub-tasks of a task when the list is shown
+        """
+
+        if self.taskTree.lookupRowid(arg) == -1:
+            self.default(self.lastcmd)
+            return
+
+        self.taskTree.collapseTask(arg)
+
+        self.__printState()
+
+    def do_expand(self, arg):
+        """
+        Show the sub-tasks of a collapsed task again
+        """
+
+        if self.taskTree.lookupRowid(arg) == -1:
+            self.default(self.lastcmd)
+            return
+
+        self.taskTree.expandTask(arg)
+
+        self.__printState()
+
+    def __expandLabels(self, patterns):
+        """
+        Return the labels of the tasks matched by label patterns, or None (after printing a 
+        warning) if any pattern matches no task
+        """
+
+        try:
+            labels = self.taskTree.expandLabels(patterns)
+        except KeyError:
+            labels = list()
+
+        if not labels:
+            self.default(self.lastcmd)
+            return None
+
+        return labels
+
+    def __isSingleLabel(arg):
+        """
+        Return True if the command argument is one plain label rather than a list, range or wildcard
+        """
+
+        return len(arg.split()) == 1 and "-" not in arg and "*" not in arg
+
+    def do_show(self, arg):
+        """
+        Choose which part of the to-do list is shown after each command
+        """
+
+        view = {'label': None, 'first': 1, 'last': None, 'depth': None}
+
+        tokens = arg.split()
+        while tokens:
+            token = tokens.pop(0)
+            window = re.fullmatch(r'(\d+)-(\d+)', token)
+
+            if token == '--depth' and tokens and tokens[0].isdigit():
+                view['depth'] = int(tokens.pop(0))
+            elif window and 0 < int(window.group(1)) <= int(window.group(2)):
+                view['first'] = int(window.group(1))
+                view['last'] = int(window.group(2))
+            elif view['label'] == None and not token.startswith('-'):
+                view['label'] = token
+            else:
+                self.default(self.lastcmd)
+                return
+
+        if view['label'] != None:
+            # Follow the task itself rather than the label, which shifts as the list changes
+            view['rowid'] = self.taskTree.lookupRowid(view['label'])
+            if view['rowid'] == -1:
+                self.default(self.lastcmd)
+                return
+
+        if view == {'label': None, 'first': 1, 'last': None, 'depth': None}:
+            self.view = None
+        else:
+            self.view = view
+
+        self.__printState()
+
     def do_undo(self, arg):
         """
         Undo the last successful command if possible
@@ -222,6 +416,35 @@ class TodoShell(cmd.Cmd):
         if cmdtoken.CommandStack.redo():
             self.__printState()
 
+    def do_stats(self, arg):
+        """
+        Show the statistics of the commands run so far:  STATS [--json [FILE]] [--sql on|off] [--reset]
+        """
+
+        tokens = arg.split()
+        if not tokens:
+            database = self.taskTree.database
+            print()
+            for line in self.stats.report():
+                print(line)
+            print()
+            print("%d SQL statements on %d connection(s), %d rows changed, %d tree read(s)" % (
+                database.statementCount, database.connectionCount, database.rowsChanged, self.taskTree.reloads))
+            if not database.tracing:
+                print("(SQL statements are only counted after 'stats --sql on')")
+            print()
+        elif tokens[0] == '--json' and len(tokens) == 1:
+            self.stats.dumpJson(sys.stdout)
+        elif tokens[0] == '--json' and len(tokens) == 2:
+            with open(tokens[1], 'a') as f:
+                self.stats.dumpJson(f)
+        elif tokens in (['--sql', 'on'], ['--sql', 'off']):
+            self.taskTree.database.setTracing(tokens[1] == 'on')
+        elif tokens == ['--reset']:
+            self.stats.reset()
+        else:
+            self.default(self.lastcmd)
+
     def do_add(self, s):
         pass
 
@@ -242,9 +465,51 @@ class TodoShell(cmd.Cmd):
         Playback commands from a file:  PLAYBACK rose.cmd
         """
 
-        self.close()
+        # Stop recording, so the file being played back can be the one recorded to
+        self.__stopRecording()
         with open(arg) as f:
-            self.cmdqueue.extend(f.read().splitlines())
+            self.runScript(f)
+
+    def runScript(self, lines):
+        """
+        Run commands from an iterable of lines without showing the list after each one. Commands 
+        are committed SCRIPT_GROUP_SIZE at a time; one that fails is rolled back on its own and 
+        reported with its line number. Blank lines and lines starting with '#' are skipped. Print 
+        the final list and return the number of commands that failed
+        """
+
+        failures = self.warnings
+        numbered = enumerate((line.strip() for line in lines), 1)
+        outerLine = self.scriptLine
+
+        try:
+            finished = False
+            while not finished:
+                group = list(itertools.islice(numbered, self.SCRIPT_GROUP_SIZE))
+                if not group:
+                    break
+
+                with self.taskTree.batch():
+                    for (number, line) in group:
+                        if not line or line.startswith('#'):
+                            continue
+                        if line == 'exit':
+                            finished = True
+                            break
+
+                        self.scriptLine = number
+                        try:
+                            with self.taskTree.batch():
+                                self.onecmd(line)
+                        except Exception as err:
+                            self.__warn("'" + line + "' failed: " + type(err).__name__ + " " + str(err))
+        finally:
+            self.scriptLine = outerLine
+
+        if self.scriptLine == None:
+            self.__printState()
+
+        return self.warnings - failures
 
     def precmd(self, line):
 
@@ -254,9 +519,9 @@ class TodoShell(cmd.Cmd):
 
     def close(self):
 
-        if self.file:
-            self.file.close()
-            self.file = None
+        self.__stopRecording()
+        self.__saveHistory()
+        self.taskTree.saveSnapshot()
 
     def execute(self):
         """
@@ -273,30 +538,70 @@ class TodoShell(cmd.Cmd):
         except:
             self.default()
 
+    def __stopRecording(self):
+        """
+        Close the file commands are being recorded to, if any
+        """
+
+        if self.file:
+            self.file.close()
+            self.file = None
+
     def __saveHistory(self):
         """
         Save command history to the database so it can be loaded for later sessions
         """
 
-        print("    # In TodoShell __saveHistory() - doing nothing")
+        # Each command's history record is committed with the command itself, so all that is
+        # left is evicting the records beyond the history's capacity
+        cmdtoken.CommandStack.checkpoint()
 
     def __loadHistory(self):
         """
         Load command history from the database saved during previous sessions
         """
 
-        print("    # In TodoShell __loadHistory() - doing nothing")
+        cmdtoken.CommandStack.load()
 
     def __printState(self):
         """
-        Print the current state of the to-do list
+        Print the current state of the to-do list (not while a script is running)
         """
 
-        today = datetime.date.today()
+        if self.scriptLine != None:
+            return
+
         print()
-        print( today.strftime("MFND - %B %d, %Y") )
+        print( time.strftime("MFND - %B %d, %Y") )
         print()
 
-        print(str(self.taskTree))
+        # The shown task may have been moved or removed since 'show' was given
+        if self.view != None and self.view['label'] != None:
+            if self.view['rowid'] in self.taskTree.nodeTable:
+                self.view['label'] = self.taskTree.lookupLabel(self.view['rowid'])
+            else:
+                self.view = None
+
+        if self.view == None:
+            lines = self.taskTree.iterLines()
+        else:
+            lines = self.taskTree.iterLines(self.view['label'], self.view['depth'])
+            lines = itertools.islice(lines, self.view['first'] - 1, self.view['last'])
+
+        self.__writeLines(lines)
+        print()
+
+    def __writeLines(self, lines):
+        """
+        Write an iterable of lines to stdout in chunks, without building the whole output first
+        """
+
+        while True:
+            chunk = "".join(itertools.islice(lines, self.CHUNK_LINES))
+            if not chunk:
+                break
+            self.stdout.write(chunk)
+
+        self.stdout.flush()
 
 
@@ -5,12 +5,16 @@ Module handles tasks in the to-do list
 
 """
 
+import sys
+
 
 class TodoTask:
     """
     Class represents a task in the to-do list
     """
 
+    __slots__ = ('description', 'position', 'completionStatus')
+
     TASK_DONE = 'done'
     TASK_UNDONE = 'todo'
 
@@ -19,9 +23,11 @@ class TodoTask:
         Initialize a to-do list task item
         """
 
+        # The handful of status values read back from SQLite share one string object each.
+        # Descriptions are mostly unique, so interning them would only cost memory
         self.description = description
         self.position = position
-        self.completionStatus = completionStatus
+        self.completionStatus = sys.intern(completionStatus)
 
     def __str__(self):
         """
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+
+Tests for TodoDatabase's per-thread connections
+
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+
+
+class ConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = TodoDatabase(os.path.join(self.directory.name, "todo_list.sqlite"))
+
+    def tearDown(self):
+
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_one_connection_per_thread(self):
+
+        connections = list()
+        thread = threading.Thread(target=lambda: connections.append(self.database.connection()))
+        thread.start()
+        thread.join()
+
+        self.assertIs(self.database.connection(), self.database.connection())
+        self.assertIsNot(connections[0], self.database.connection())
+        self.assertEqual(self.database.connectionCount, 2)
+
+    def test_close_after_another_thread(self):
+
+        connections = list()
+        thread = threading.Thread(target=lambda: connections.append(self.database.connection()))
+        thread.start()
+        thread.join()
+
+        self.database.close()
+
+        self.assertTrue(self.database.closed)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connections[0].execute("SELECT 1;")
+        with self.assertRaises(sqlite3.ProgrammingError):
+            self.database.connection()
+
+if  __name__ =='__main__':
+    unittest.main()
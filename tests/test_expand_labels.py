@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+
+Tests for the lists, ranges and wildcards accepted by TaskTree.expandLabels
+
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+from tasktree import TaskTree
+from todotask import TodoTask
+
+
+# Patterns and the labels they expand to, against the tree built in setUp
+CASES = [
+    (["1"], ["1."]),
+    (["2."], ["2."]),
+    (["2.c.1"], ["2.c.1."]),
+    (["1-3"], ["1.", "2.", "3."]),
+    (["2-2"], ["2."]),
+    (["2.a-2.c"], ["2.a.", "2.b.", "2.c."]),
+    (["2.b-c"], ["2.b.", "2.c."]),
+    (["2.c.1-2"], ["2.c.1.", "2.c.2."]),
+    (["1.-2."], ["1.", "2."]),
+    (["2.*"], ["2.a.", "2.b.", "2.c."]),
+    (["2.c.*"], ["2.c.1.", "2.c.2."]),
+    (["1.*"], []),
+    (["3", "1-2"], ["3.", "1.", "2."]),
+    (["2.a", "2.*", "3.*"], ["2.a.", "2.b.", "2.c.", "3.a."]),
+    (["2.a-b", "2.b", "2.a"], ["2.a.", "2.b."]),
+    (["1", "2.c.*", "3.a"], ["1.", "2.c.1.", "2.c.2.", "3.a."]),
+]
+
+# Patterns that match no task, or siblings in the wrong order or under different parents
+BAD_PATTERNS = [
+    ["9"],
+    ["2.d"],
+    ["9.*"],
+    ["1-9"],
+    ["2.a-z"],
+    ["3-1"],
+    ["2.c-a"],
+    ["2.c.2-1"],
+    ["1-2.a"],
+    ["2.a-3.a"],
+    ["1", "9"],
+]
+
+class ExpandLabelsTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = TodoDatabase(os.path.join(self.directory.name, "todo_list.sqlite"))
+        self.taskTree = TaskTree(self.database)
+
+        for description in ("one", "two", "three"):
+            self.taskTree.insertTask(TodoTask(description))
+        for description in ("two a", "two b", "two c"):
+            self.taskTree.insertTask(TodoTask(description), "2")
+        for description in ("two c 1", "two c 2"):
+            self.taskTree.insertTask(TodoTask(description), "2.c")
+        self.taskTree.insertTask(TodoTask("three a"), "3")
+
+    def tearDown(self):
+
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_patterns(self):
+
+        for (patterns, labels) in CASES:
+            with self.subTest(patterns=patterns):
+                self.assertEqual(self.taskTree.expandLabels(patterns), labels)
+
+    def test_bad_patterns(self):
+
+        for patterns in BAD_PATTERNS:
+            with self.subTest(patterns=patterns):
+                with self.assertRaises(KeyError):
+                    self.taskTree.expandLabels(patterns)
+
+    def test_collapsed_task(self):
+
+        # Sub-tasks of a collapsed task are read from the database to expand a wildcard
+        self.taskTree.collapseTask("2")
+        self.taskTree.readDatabase()
+
+        self.assertEqual(self.taskTree.expandLabels(["2.*"]), ["2.a.", "2.b.", "2.c."])
+        self.assertEqual(self.taskTree.expandLabels(["2.c.1-2"]), ["2.c.1.", "2.c.2."])
+
+if  __name__ =='__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+
+Tests for upgrading older to-do list files through TodoDatabase.MIGRATIONS
+
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+from todotask import TodoTask
+
+
+def writeVersion2File(path):
+    """
+    Write a to-do list file as schema version 2 left it: the root and [default] tasks and three
+    tasks at 1-based positions
+    """
+
+    conn = sqlite3.connect(path)
+    conn.isolation_level = None
+    conn.execute(TodoDatabase.CREATE_TABLE_TODOTASK)
+    conn.execute(TodoDatabase.CREATE_TABLE_CLOSURETABLE)
+    conn.execute(TodoDatabase.CREATE_TABLE_CONFIGTIME)
+    conn.execute(TodoDatabase.SETUP_CONFIGTIME)
+
+    # lastInitTime is now, so opening the file does not clear the list
+    conn.execute("UPDATE ConfigTime SET lastInitTime = strftime('%s', 'now') + 0 WHERE id = 1;")
+
+    tasks = [(1, None, '[root]', 1), (2, 1, '[default]', 1), (3, 2, 'one', 1), (4, 2, 'two', 2), (5, 2, 'three', 3)]
+    conn.executemany("INSERT INTO TodoTask (rowid, parentID, description, position) VALUES (?, ?, ?, ?);", tasks)
+    closure = [(1, 1, 0), (2, 2, 0), (1, 2, 1)]
+    for rowid in (3, 4, 5):
+        closure += [(rowid, rowid, 0), (2, rowid, 1), (1, rowid, 2)]
+    conn.executemany("INSERT INTO ClosureTable (parentID, childID, depth) VALUES (?, ?, ?);", closure)
+
+    conn.execute("PRAGMA user_version = 2;")
+    conn.close()
+
+class MigrationTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "todo_list.sqlite")
+        writeVersion2File(self.path)
+
+    def tearDown(self):
+
+        self.directory.cleanup()
+
+    def readTasks(self, database):
+
+        return database.connection().execute(
+            "SELECT rowid, position, depth FROM TodoTask WHERE parentID = 2 ORDER BY position;").fetchall()
+
+    def test_upgrade_to_current_version(self):
+
+        with TodoDatabase(self.path) as database:
+            self.assertEqual(database.schemaVersion(), len(TodoDatabase.MIGRATIONS))
+            self.assertEqual(self.readTasks(database), [(3, 1024, 2), (4, 2048, 2), (5, 3072, 2)])
+
+    def test_positions_are_spaced_by_the_configured_gap(self):
+
+        with TodoDatabase(self.path, positionGap=100) as database:
+            self.assertEqual(self.readTasks(database), [(3, 100, 2), (4, 200, 2), (5, 300, 2)])
+
+            # New tasks go after the rescaled keys
+            rowid = database.insertTask(TodoTask("four"), 2)
+            self.assertEqual(self.readTasks(database)[-1], (rowid, 400, 2))
+
+if  __name__ =='__main__':
+    unittest.main()
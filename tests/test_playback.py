@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+
+Tests for recording commands to a file and playing them back
+
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+from tasktree import TaskTree
+from todoshell import TodoShell
+
+
+class PlaybackTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = TodoDatabase(os.path.join(self.directory.name, "todo_list.sqlite"))
+        self.taskTree = TaskTree(self.database)
+        self.shell = TodoShell(self.taskTree)
+        self.shell.stdout = io.StringIO()
+        self.scriptPath = os.path.join(self.directory.name, "rose.cmd")
+
+    def tearDown(self):
+
+        self.database.close()
+        self.directory.cleanup()
+
+    def runLine(self, line):
+        """
+        Run a command line as the shell's command loop does
+        """
+
+        with contextlib.redirect_stdout(self.shell.stdout):
+            self.shell.onecmd(self.shell.precmd(line))
+
+    def test_record_and_playback(self):
+
+        self.runLine("record " + self.scriptPath)
+        self.runLine("todo one")
+        self.runLine("todosub 1 one a")
+
+        # Playing back only closes the file being recorded to; the session itself goes on
+        snapshots = list()
+        self.taskTree.saveSnapshot = lambda: snapshots.append(True)
+        self.runLine("playback " + self.scriptPath)
+
+        self.assertIsNone(self.shell.file)
+        self.assertEqual(snapshots, [])
+        self.assertEqual(str(self.taskTree).split(), ["1.", "one", "1.a.", "one", "a", "1.b.", "one", "a", "2.", "one"])
+
+if  __name__ =='__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+
+Tests that TodoDatabase's hot statements are answered from indexes rather than table scans
+
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+
+
+# Statements (and their binds) whose plans must only SEARCH, never SCAN
+CHECKED_STATEMENTS = [
+    ('SELECT_NEIGHBOUR_KEYS', (2, 3, 0)),
+    ('SELECT_LAST_KEYS', (2,)),
+    ('SELECT_SIBLING_ROWIDS', (2, 3)),
+    ('SELECT_RANK', (2, 1024)),
+    ('SELECT_IS_DESCENDANT', (2, 3)),
+    ('UPDATE_SUBTREE_DEPTH', {'rowid': 3, 'parentID': 2}),
+    ('DELETE_SUBTREE_ANCESTRY', {'rowid': 3}),
+    ('INSERT_SUBTREE_ANCESTRY', {'rowid': 3, 'parentID': 2}),
+    ('SELECT_SUBTREE', (3,)),
+    ('UPDATE_COLLAPSED', (1, 3)),
+    ('COLLECT_SUBTREE', (3,)),
+    ('DELETE_SUBTREE_TASKS', ()),
+    ('DELETE_SUBTREE_CLOSURE', ()),
+]
+
+# Statements equivalent to the body of the TodoTask_insert trigger
+TRIGGER_STATEMENTS = [
+    ('insert trigger: link ancestors',
+        "SELECT p.parentID, c.childID FROM ClosureTable AS p, ClosureTable AS c WHERE p.childID = ? AND c.parentID = ?;", (2, 3)),
+]
+
+def findScans(plan):
+    """
+    Return the plan steps that scan a table or index
+    """
+
+    return [step for step in plan if step.startswith("SCAN")]
+
+class QueryPlanTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = TodoDatabase(os.path.join(self.directory.name, "plans.sqlite"))
+
+    def tearDown(self):
+
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_tree_load_uses_parent_index(self):
+
+        # The tree load must reach visible tasks through the parent index, never by scanning
+        # TodoTask (the recursive step's queue is what keeps parents before children)
+        plan = self.database.explainQueryPlan(TodoDatabase.SELECT_TASKTREE)
+
+        self.assertEqual([step for step in findScans(plan) if "TodoTask" in step], [], "; ".join(plan))
+        self.assertIn("INDEX", " ".join(plan))
+
+    def test_statements_search_indexes(self):
+
+        for (name, params) in CHECKED_STATEMENTS:
+            with self.subTest(name):
+                plan = self.database.explainQueryPlan(getattr(TodoDatabase, name), params)
+                self.assertEqual(findScans(plan), [], "; ".join(plan))
+
+    def test_trigger_statements_search_indexes(self):
+
+        for (name, sql, params) in TRIGGER_STATEMENTS:
+            with self.subTest(name):
+                plan = self.database.explainQueryPlan(sql, params)
+                self.assertEqual(findScans(plan), [], "; ".join(plan))
+
+if  __name__ =='__main__':
+    unittest.main()
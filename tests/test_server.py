@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+
+Tests for the commands clients send to the resident server
+
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+from server import TodoServer
+from tasktree import TaskTree
+from todoshell import TodoShell
+
+
+class RunCommandTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = TodoDatabase(os.path.join(self.directory.name, "todo_list.sqlite"))
+        self.shell = TodoShell(TaskTree(self.database))
+        self.server = TodoServer(os.path.join(self.directory.name, "mfnd.sock"), self.shell)
+
+    def tearDown(self):
+
+        self.server.server_close()
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_command(self):
+
+        (ok, output) = self.server.runCommand("todo water the plants")
+
+        self.assertTrue(ok)
+        self.assertIn(" 1. water the plants", output)
+
+    def test_failed_command(self):
+
+        (ok, output) = self.server.runCommand("done 9")
+
+        self.assertFalse(ok)
+        self.assertIn("!!! Warning", output)
+
+    def test_exit_commands_are_refused(self):
+
+        for line in ("exit", "exit now", "exit 1", "EOF", "quit", "quit 1"):
+            with self.subTest(line):
+                (ok, output) = self.server.runCommand(line)
+                self.assertFalse(ok)
+                self.assertIn("cannot stop the server", output)
+
+        (ok, output) = self.server.runCommand("todo still running")
+        self.assertTrue(ok)
+
+    def test_system_exit_stops_the_server(self):
+
+        # As when SIGTERM arrives while a command runs
+        def exitCommand(arg):
+            sys.exit(0)
+
+        self.shell.do_stop = exitCommand
+        shellStdout = self.shell.stdout
+
+        with self.assertRaises(SystemExit):
+            self.server.runCommand("stop")
+
+        self.assertIs(self.shell.stdout, shellStdout)
+
+if  __name__ =='__main__':
+    unittest.main()
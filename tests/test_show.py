@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+
+Tests for the part of the list the 'show' command selects
+
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+from tasktree import TaskTree
+from todoshell import TodoShell
+from todotask import TodoTask
+
+
+# 'show' arguments and the tasks then shown, in order
+CASES = [
+    ("", ["one", "one a", "one a 1", "one b", "two", "two a"]),
+    ("--depth 0", ["one", "two"]),
+    ("--depth 1", ["one", "one a", "one b", "two", "two a"]),
+    ("--depth 2", ["one", "one a", "one a 1", "one b", "two", "two a"]),
+    ("1", ["one", "one a", "one a 1", "one b"]),
+    ("1 --depth 0", ["one"]),
+    ("1 --depth 1", ["one", "one a", "one b"]),
+    ("1.a --depth 0", ["one a"]),
+    ("1.a --depth 1", ["one a", "one a 1"]),
+    ("2-4", ["one a", "one a 1", "one b"]),
+    ("1 2-3 --depth 1", ["one a", "one b"]),
+    ("--depth 1 3-9", ["one b", "two", "two a"]),
+]
+
+class ShowTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = TodoDatabase(os.path.join(self.directory.name, "todo_list.sqlite"))
+        taskTree = TaskTree(self.database)
+
+        for description in ("one", "two"):
+            taskTree.insertTask(TodoTask(description))
+        for (parentLabel, description) in [("1", "one a"), ("1", "one b"), ("1.a", "one a 1"), ("2", "two a")]:
+            taskTree.insertTask(TodoTask(description), parentLabel)
+
+        self.shell = TodoShell(taskTree)
+
+    def tearDown(self):
+
+        self.database.close()
+        self.directory.cleanup()
+
+    def shownTasks(self, line):
+        """
+        Run a command line and return the descriptions of the tasks it printed
+        """
+
+        output = io.StringIO()
+        self.shell.stdout = output
+        with contextlib.redirect_stdout(output):
+            self.shell.onecmd(line)
+
+        lines = [line.strip() for line in output.getvalue().splitlines()]
+        return [line.split(" ", 1)[1] for line in lines if line[:1].isdigit()]
+
+    def test_show(self):
+
+        for (arg, tasks) in CASES:
+            with self.subTest(arg):
+                self.assertEqual(self.shownTasks("show " + arg), tasks)
+
+    def test_view_follows_the_task(self):
+
+        self.shownTasks("show 2 --depth 0")
+        self.assertEqual(self.shownTasks("move 2 top"), ["two"])
+        self.assertEqual(self.shownTasks("remove 2"), ["two"])
+
+        # Once the shown task is gone, the whole list is shown again
+        self.assertEqual(self.shownTasks("remove 1"), [])
+        self.assertEqual(self.shownTasks("todo three"), ["three"])
+
+    def test_bad_arguments(self):
+
+        for arg in ("9", "--depth", "--depth x", "3-1", "1 2"):
+            with self.subTest(arg):
+                warnings = self.shell.warnings
+                self.shownTasks("show " + arg)
+                self.assertEqual(self.shell.warnings, warnings + 1)
+
+if  __name__ =='__main__':
+    unittest.main()
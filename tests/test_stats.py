@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+
+Tests for the per-command figures the 'stats' command reports
+
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+from database import TodoDatabase
+from tasktree import TaskTree
+from todoshell import TodoShell
+
+
+# Command lines, run in turn, and the task rows each one changes
+CASES = [
+    ("todo one", 1),
+    ("todo two", 1),
+    ("todosub 1 one a", 1),
+    ("todosub 1 one b", 1),
+    ("done 1", 1),
+    ("collapse 1", 1),
+    ("move 2 top", 1),
+    ("remove 2", 3),
+    ("undo", 3),
+    ("redo", 3),
+]
+
+class RowsProbeTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = TodoDatabase(os.path.join(self.directory.name, "todo_list.sqlite"))
+        self.shell = TodoShell(TaskTree(self.database))
+        self.shell.stdout = io.StringIO()
+
+    def tearDown(self):
+
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_rows_changed(self):
+
+        stats = self.shell.stats
+        index = stats.metrics.index('rows')
+
+        # ClosureTable, history and other bookkeeping rows are not counted
+        for (line, rows) in CASES:
+            with self.subTest(line):
+                with contextlib.redirect_stdout(self.shell.stdout):
+                    self.shell.onecmd(line)
+                (name, when, values) = stats.recent[-1]
+                self.assertEqual(name, self.shell.parseline(line)[0])
+                self.assertEqual(values[index], rows)
+
+if  __name__ =='__main__':
+    unittest.main()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+
+Tests for the undo/redo history of CommandStack and the row-level change sets it replays
+
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "mfnd"))
+
+import cmdtoken
+from cmdtoken import CommandStack
+from database import TodoDatabase
+from tasktree import TaskTree
+from todotask import TodoTask
+
+
+def databaseState(database):
+    """
+    Return every TodoTask and ClosureTable row, in a comparable form
+    """
+
+    conn = database.connection()
+    tasks = conn.execute("SELECT * FROM TodoTask ORDER BY rowid;").fetchall()
+    closure = conn.execute("SELECT parentID, childID, depth FROM ClosureTable ORDER BY 1, 2;").fetchall()
+
+    return (tasks, closure)
+
+def treeState(taskTree):
+    """
+    Return the tasks shown by a task tree, with their labels and positions, in list order
+    """
+
+    state = list()
+    stack = [taskTree.mode]
+    while stack:
+        node = stack.pop()
+        state.append((node.rowid, node.parentID, node.label, node.depth, node.task.position,
+            node.task.description, node.task.completionStatus, node.collapsed))
+        if taskTree.labelTable.get(node.label[:-1]) is not node and node is not taskTree.mode:
+            state.append(('not indexed', node.label))
+        if not node.collapsed:
+            stack.extend(reversed(node.children))
+
+    return state
+
+class HistoryTest(unittest.TestCase):
+    """
+    Base class opening an empty list with an empty history
+    """
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "todo_list.sqlite")
+        self.database = TodoDatabase(self.path)
+        self.open()
+
+        CommandStack.stats = None
+        CommandStack.capacity = 1000
+        CommandStack.checkpointInterval = 100
+
+    def tearDown(self):
+
+        self.database.close()
+        self.directory.cleanup()
+
+    def open(self):
+
+        self.taskTree = TaskTree(self.database)
+        CommandStack.setTaskTree(self.taskTree)
+        CommandStack.load()
+
+    def assertCursorSaved(self):
+        """
+        Check that the cursor in memory matches the history stored in the database
+        """
+
+        self.assertEqual((CommandStack.cursor, CommandStack.oldest, CommandStack.newest),
+            self.database.historyBounds())
+
+def buildList(taskTree):
+    """
+    Fill an empty list with tasks on four levels. Task 2.a is collapsed, and its sub-tasks are 
+    left unloaded. Task 4 is done
+    """
+
+    for description in ("one", "two", "three", "four"):
+        taskTree.insertTask(TodoTask(description))
+    for (parentLabel, descriptions) in [("1", ("one a", "one b")), ("2", ("two a", "two b")),
+            ("2.a", ("two a 1", "two a 2")), ("2.a.1", ("two a 1 1",))]:
+        for description in descriptions:
+            taskTree.insertTask(TodoTask(description), parentLabel)
+
+    taskTree.setDone("4")
+    taskTree.collapseTask("2.a")
+    taskTree.readDatabase()
+
+# Commands replayed by the tests, each against the list built by buildList: a name, the labels 
+# the command acts on and a function returning its token
+COMMANDS = [
+    ('todo', [], lambda: cmdtoken.TodoCommand(TodoTask("new"))),
+    ('todosub', ["1"], lambda: cmdtoken.TodosubCommand(TodoTask("new sub"), "1")),
+    ('todosub in collapsed', ["2.a.1"], lambda: cmdtoken.TodosubCommand(TodoTask("new sub"), "2.a.1")),
+    ('done', ["1.b"], lambda: cmdtoken.DoneCommand("1.b")),
+    ('done in collapsed', ["2.a.2"], lambda: cmdtoken.DoneCommand("2.a.2")),
+    ('remove', ["1"], lambda: cmdtoken.RemoveCommand("1")),
+    ('remove with collapsed descendants', ["2"], lambda: cmdtoken.RemoveCommand("2")),
+    ('remove collapsed', ["2.a"], lambda: cmdtoken.RemoveCommand("2.a")),
+    ('remove in collapsed', ["2.a.1"], lambda: cmdtoken.RemoveCommand("2.a.1")),
+    ('move up', ["2"], lambda: cmdtoken.MoveUpCommand("2")),
+    ('move down', ["1"], lambda: cmdtoken.MoveDownCommand("1")),
+    ('move top', ["3"], lambda: cmdtoken.MoveTopCommand("3")),
+    ('move bottom', ["1.a"], lambda: cmdtoken.MoveBottomCommand("1.a")),
+    ('move under', ["3", "1.b"], lambda: cmdtoken.MoveUnderCommand("3", "1.b")),
+    ('move collapsed under', ["2.a", "3"], lambda: cmdtoken.MoveUnderCommand("2.a", "3")),
+    ('move under collapsed', ["1", "2.a"], lambda: cmdtoken.MoveUnderCommand("1", "2.a")),
+    ('batch done', ["1.a", "3", "4", "2.a.1.1"], lambda: cmdtoken.BatchDoneCommand(["1.a", "3", "4", "2.a.1.1"])),
+    ('batch remove', ["1.a", "2", "2.a.2", "3"], lambda: cmdtoken.BatchRemoveCommand(["1.a", "2", "2.a.2", "3"])),
+    ('batch move under', ["1.b", "3", "4", "2.b"], lambda: cmdtoken.BatchMoveUnderCommand(["1.b", "3", "4"], "2.b")),
+    ('batch move under collapsed', ["1", "2.b", "2.a"], lambda: cmdtoken.BatchMoveUnderCommand(["1", "2.b"], "2.a")),
+    ('batch move under with sub-task', ["1", "1.a", "3"], lambda: cmdtoken.BatchMoveUnderCommand(["1", "1.a"], "3")),
+]
+
+class ChangeSetTest(HistoryTest):
+    """
+    Undo and redo each command, checking the tree in memory and the database against their 
+    state before and after it
+    """
+
+    def setUp(self):
+
+        super().setUp()
+        buildList(self.taskTree)
+
+    def states(self):
+        """
+        Return the database state and the state of the tree in memory, checking that the latter 
+        matches a tree read afresh from the database
+        """
+
+        shown = treeState(self.taskTree)
+        self.assertEqual(shown, treeState(TaskTree(self.database)))
+        self.assertEqual(str(self.taskTree), str(TaskTree(self.database)))
+
+        return (databaseState(self.database), shown)
+
+    def test_commands(self):
+
+        for (name, labels, command) in COMMANDS:
+            with self.subTest(name):
+                self.tearDown()
+                self.setUp()
+
+                before = self.states()
+                command().execute()
+                after = self.states()
+                self.assertNotEqual(after, before)
+
+                for run in range(2):
+                    self.assertTrue(CommandStack.undo())
+                    self.assertEqual(self.states(), before)
+                    self.assertTrue(CommandStack.redo())
+                    self.assertEqual(self.states(), after)
+                    self.assertCursorSaved()
+
+    def test_command_sequence(self):
+
+        states = [self.states()]
+        for (name, labels, command) in COMMANDS:
+            # As in the shell, commands on tasks an earlier command removed are not run, and 
+            # moves under a task's own sub-tasks fail without changing anything
+            if -1 in [self.taskTree.lookupRowid(label) for label in labels]:
+                continue
+            try:
+                command().execute()
+            except TodoDatabase.TaskIndexException:
+                self.assertEqual(self.states(), states[-1])
+                continue
+            states.append(self.states())
+
+        for state in reversed(states[:-1]):
+            self.assertTrue(CommandStack.undo())
+            self.assertEqual(self.states(), state)
+        self.assertFalse(CommandStack.undo())
+
+        for state in states[1:]:
+            self.assertTrue(CommandStack.redo())
+            self.assertEqual(self.states(), state)
+        self.assertFalse(CommandStack.redo())
+
+    def test_undo_after_restart(self):
+
+        before = self.states()
+        for (name, labels, command) in COMMANDS[:3]:
+            command().execute()
+        after = self.states()
+
+        # A new session reads the cursor and history back from the database
+        self.database.close()
+        self.database = TodoDatabase(self.path)
+        CommandStack.cursor = 0
+        CommandStack.oldest = CommandStack.newest = None
+        self.open()
+        self.assertEqual(self.states(), after)
+        self.assertEqual(CommandStack.cursor, 3)
+
+        for run in range(3):
+            self.assertTrue(CommandStack.undo())
+        self.assertFalse(CommandStack.undo())
+        self.assertEqual(self.states(), before)
+
+        # Undone commands can still be redone after another restart
+        self.database.close()
+        self.database = TodoDatabase(self.path)
+        self.open()
+        self.assertEqual(CommandStack.cursor, 0)
+
+        for run in range(3):
+            self.assertTrue(CommandStack.redo())
+        self.assertFalse(CommandStack.redo())
+        self.assertEqual(self.states(), after)
+
+    def test_move_with_sub_task(self):
+
+        # A task moved along with its parent stays inside it
+        cmdtoken.BatchMoveUnderCommand(["1", "1.a"], "2").execute()
+
+        descriptions = [node[5] for node in treeState(self.taskTree)]
+        self.assertEqual(descriptions[1:], ["two", "two a", "two b", "one", "one a", "one b", "three", "four"])
+        self.assertEqual(self.taskTree.expandLabels(["1.c.*"]), ["1.c.1.", "1.c.2."])
+
+class RollbackTest(HistoryTest):
+
+    def test_rolled_back_command_leaves_no_history(self):
+
+        cmdtoken.TodoCommand(TodoTask("one")).execute()
+        before = (databaseState(self.database), treeState(self.taskTree))
+
+        # As in a script group that fails after one of its commands was pushed
+        with self.assertRaises(RuntimeError):
+            with self.taskTree.batch():
+                cmdtoken.TodoCommand(TodoTask("two")).execute()
+                raise RuntimeError("later failure")
+
+        self.assertEqual((databaseState(self.database), treeState(self.taskTree)), before)
+        self.assertCursorSaved()
+        self.assertEqual(CommandStack.cursor, 1)
+
+        self.assertTrue(CommandStack.undo())
+        self.assertEqual(treeState(self.taskTree), [treeState(self.taskTree)[0]])
+        self.assertFalse(CommandStack.undo())
+
+        self.assertTrue(CommandStack.redo())
+        self.assertEqual((databaseState(self.database), treeState(self.taskTree)), before)
+        self.assertFalse(CommandStack.redo())
+
+    def test_rolled_back_undo_keeps_cursor(self):
+
+        cmdtoken.TodoCommand(TodoTask("one")).execute()
+
+        with self.assertRaises(RuntimeError):
+            with self.taskTree.batch():
+                CommandStack.undo()
+                raise RuntimeError("later failure")
+
+        self.assertCursorSaved()
+        self.assertEqual(CommandStack.cursor, 1)
+        self.assertEqual(self.taskTree.expandLabels(["1"]), ["1."])
+
+class TwoConnectionTest(HistoryTest):
+    """
+    Two sessions, each with its own connection, task tree and history cursor, taking turns on 
+    the same database
+    """
+
+    def setUp(self):
+
+        super().setUp()
+        self.databaseB = TodoDatabase(self.path)
+        self.treeA = self.taskTree
+        self.treeB = TaskTree(self.databaseB)
+        self.cursors = {self.treeB: self.databaseB.historyBounds()}
+
+    def tearDown(self):
+
+        self.databaseB.close()
+        super().tearDown()
+
+    def switchTo(self, taskTree):
+        """
+        Make CommandStack act for the session of 'taskTree', as if it ran in its own process
+        """
+
+        self.cursors[CommandStack.taskTree] = (CommandStack.cursor, CommandStack.oldest, CommandStack.newest)
+        CommandStack.setTaskTree(taskTree)
+        (CommandStack.cursor, CommandStack.oldest, CommandStack.newest) = self.cursors[taskTree]
+
+    def test_commands_in_turn(self):
+
+        cmdtoken.TodoCommand(TodoTask("a1")).execute()
+        self.switchTo(self.treeB)
+        cmdtoken.TodoCommand(TodoTask("b1")).execute()
+        cmdtoken.TodoCommand(TodoTask("b2")).execute()
+        self.switchTo(self.treeA)
+        cmdtoken.TodoCommand(TodoTask("a2")).execute()
+
+        # No history record was overwritten from a stale cursor, and the tree shows every task
+        self.assertCursorSaved()
+        self.assertEqual(self.database.historyBounds(), (4, 1, 4))
+        self.assertEqual(treeState(self.treeA), treeState(TaskTree(self.database)))
+        self.assertEqual(str(self.treeA).split(), ["1.", "a1", "2.", "b1", "3.", "b2", "4.", "a2"])
+
+        for tasks in (["a1", "b1", "b2"], ["a1", "b1"], ["a1"], []):
+            self.assertTrue(CommandStack.undo())
+            self.assertEqual([node[5] for node in treeState(self.treeA)[1:]], tasks)
+        self.assertFalse(CommandStack.undo())
+
+    def test_undo_in_turn(self):
+
+        cmdtoken.TodoCommand(TodoTask("a1")).execute()
+        self.switchTo(self.treeB)
+        cmdtoken.TodoCommand(TodoTask("b1")).execute()
+        self.assertTrue(CommandStack.undo())
+        self.assertTrue(CommandStack.undo())
+        self.switchTo(self.treeA)
+
+        # A's cursor is read again before checking whether there is anything to undo
+        self.assertFalse(CommandStack.undo())
+        self.assertEqual(treeState(self.treeA)[1:], [])
+        self.assertTrue(CommandStack.redo())
+        self.assertEqual([node[5] for node in treeState(self.treeA)[1:]], ["a1"])
+        self.assertCursorSaved()
+
+if  __name__ =='__main__':
+    unittest.main()